@@ -0,0 +1,246 @@
+import Queue
+import ftplib
+import threading
+import time
+import traceback
+from multiprocessing.pool import ThreadPool
+import json
+import os
+from collections import OrderedDict
+from datetime import datetime
+import instrument
+import pyftpbbc
+from cache import DayCache
+from columns import ColumnStore
+from data import ChunkParser, DroneProcessor, process_cabauw_data, cabauw_levels, cabauw_rows, radio_columns
+
+
+basetime = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) 
+# the ftp config of the Cabauw feed, point it elsewhere e.g. for a replay (see benchmarks/latency.py)
+config_cabauw = 'ftp_cabauw.json'
+metadata_cabauw = json.loads(open('metadata_cab.json').read())['metadata']['columns']
+levels_cabauw = cabauw_levels(metadata_cabauw)
+cabauw_manifest = {}
+# feed -> ColumnStore with the rows the cache could not store yet, see save
+unsaved = {}
+
+
+class DroneFeed(object):
+    # one drone: where its file is, how it is laid out, and how far it has been read and processed.
+    # filename is the strftime pattern of the file of the day in the directory of config
+    def __init__(self, name, config='ftp_radio.json', metadata='metadata_radio.json', filename='%Y%m%d.txt'):
+        self.name = name
+        self.config = config
+        self.metadata = json.loads(open(metadata).read())['metadata']['columns']
+        self.filename = filename
+        self.tail = pyftpbbc.FileTail()
+        self.processor = DroneProcessor(self.metadata)
+
+    def fetch(self, write):
+        try:
+            pyftpbbc.tail(self.config, basetime.strftime(self.filename), self.tail, write)
+        except ftplib.error_perm as e:
+            # 550: no file today yet, the drone has not flown
+            if not str(e).startswith('550'):
+                raise
+
+    def get_state(self):
+        # how far its file has been read and processed, see set_state
+        previous = self.processor.previous
+        return {'tail': self.tail.as_dict(), 'processor': [float(v) for v in previous] if previous is not None else None}
+
+    def set_state(self, state):
+        self.tail = pyftpbbc.FileTail.from_dict(state['tail'])
+        previous = state['processor']
+        self.processor.previous = tuple(previous) if previous is not None else None
+
+def load_drones(path='drones.json'):
+    # the drones flying today: path holds a list of {"name", "config", "metadata", "filename"},
+    # all but the name optional. without it there is one drone, named drone, in ftp_radio.json
+    if not os.path.exists(path):
+        return [DroneFeed('drone')]
+    with open(path) as f:
+        drones = [DroneFeed(**dict((str(k), v) for (k, v) in d.items())) for d in json.load(f)]
+    names = [d.name for d in drones]
+    if 'cabauw' in names or len(set(names)) != len(names):
+        raise ValueError('Drone names in {0} must be unique and not cabauw, got {1}'.format(path, names))
+    return drones
+
+drones = load_drones()
+
+
+def getSensorData(latest_drone_times, latest_cabauw_time, latest_cabauw_pressure):
+    # latest_drone_times: dict of drone name -> time of its newest sample. returns the new
+    # samples as (dict of drone name -> drone data, cabauw data).
+    # the lines are parsed while they arrive. every drone file is fetched and processed on a
+    # helper thread of its own while the Cabauw files come in, so a poll takes as long as the
+    # slowest transfer. a drone that fails has no new rows and is read again on the next poll,
+    # the other drones and Cabauw go on
+    parsers = dict((drone.name, ChunkParser(radio_columns, drone.metadata)) for drone in drones)
+    data_cab = ChunkParser(cabauw_rows, metadata_cabauw)
+    record = instrument.current()
+    saved = get_state()
+    def failed(drone):
+        traceback.print_exc()
+        drone.set_state(saved['drones'][drone.name])
+        parsers[drone.name] = ChunkParser(radio_columns, drone.metadata)
+
+    def fetch_radio(drone):
+        with instrument.within(record):
+            with instrument.stage('fetch_radio'):
+                try:
+                    drone.fetch(parsers[drone.name].feed)
+                except Exception:
+                    failed(drone)
+
+    pool = ThreadPool(len(drones))
+    try:
+        radio = pool.map_async(fetch_radio, drones)
+        with instrument.stage('fetch_cabauw'):
+            pyftpbbc.poll_all(config_cabauw, basetime.strftime('%Y%m%d'), cabauw_manifest, data_cab.feed)
+        radio.get()
+        instrument.count('drone_rows_fetched', sum(p.rows for p in parsers.values()))
+        instrument.count('cabauw_rows_fetched', data_cab.rows)
+
+        cabauw_data = process_cabauw_data(data_cab, basetime, metadata_cabauw, latest_cabauw_time)
+        cab_pres = cabauw_data['air_pressure'][-1] if len(cabauw_data['air_pressure']) > 0 else latest_cabauw_pressure
+
+        def process_radio(drone):
+            with instrument.within(record):
+                try:
+                    return drone.processor.process(parsers[drone.name], basetime, cab_pres, latest_drone_times.get(drone.name))
+                except Exception:
+                    failed(drone)
+                    return drone.processor.process(parsers[drone.name], basetime, cab_pres, latest_drone_times.get(drone.name))
+        drone_data = dict(zip([d.name for d in drones], pool.map(process_radio, drones)))
+    except:
+        # when Cabauw fails the drones are read again on the next poll as well
+        radio.wait()
+        set_state(saved)
+        raise
+    finally:
+        pool.close()
+    return (drone_data, cabauw_data) 
+
+
+def get_state():
+    # how far the feeds have been read and processed, see set_state
+    return {
+        'drones': dict((drone.name, drone.get_state()) for drone in drones),
+        'cabauw_manifest': dict((f, tail.as_dict()) for (f, tail) in cabauw_manifest.items())
+    }
+
+def set_state(state):
+    drone_states = state.get('drones')
+    if drone_states is None:
+        # written before there could be several drones
+        drone_states = {'drone': {'tail': state['radio_tail'], 'processor': state['drone_processor']}}
+    for drone in drones:
+        # a drone that is new today starts from the beginning of its file
+        drone.set_state(drone_states.get(drone.name, {'tail': pyftpbbc.FileTail().as_dict(), 'processor': None}))
+    cabauw_manifest.clear()
+    for (f, tail) in state['cabauw_manifest'].items():
+        cabauw_manifest[str(f)] = pyftpbbc.FileTail.from_dict(tail)
+
+def day_cache(directory='cache'):
+    return DayCache(os.path.join(directory, basetime.strftime('%Y%m%d')))
+
+def save(cache, feeds):
+    # appends the new rows of feeds to the cache, with the state of having read them. rows
+    # that could not be written (e.g. a full disk) are kept and written with the next ones,
+    # the feeds are not read again for them and the cache gets no gap
+    for (feed, columns) in feeds.items():
+        unsaved.setdefault(feed, ColumnStore()).append(columns)
+    cache.append(dict((feed, store.as_dict()) for (feed, store) in unsaved.items()), get_state())
+    unsaved.clear()
+
+def latest_times(stores):
+    # dict of drone name -> time of the newest sample in its column store
+    return dict((name, store.last('time')) for (name, store) in stores.items())
+
+def load_stores(cache=None, max_rows=None):
+    # (dict of drone name -> column store, cabauw column store) with the day so far: what
+    # is in the cache, and whatever was added on the server since. without a cache the whole
+    # day is fetched. the drone stores are in the order of drones
+    data = (OrderedDict((drone.name, ColumnStore(max_rows=max_rows)) for drone in drones), ColumnStore(max_rows=max_rows))
+    if cache is not None and cache.state is not None:
+        set_state(cache.state)
+        for (name, store) in data[0].items():
+            store.append(cache.load(name))
+        data[1].append(cache.load('cabauw'))
+    (drone_data, cabauw_data) = getSensorData(latest_times(data[0]), data[1].last('time'), data[1].last('air_pressure'))
+    for (name, store) in data[0].items():
+        store.append(drone_data[name])
+    data[1].append(cabauw_data)
+    if cache is not None:
+        try:
+            save(cache, dict(drone_data, cabauw=cabauw_data))
+        except Exception:
+            # the rows are shown anyway, they are written with the next poll
+            traceback.print_exc()
+    return data
+
+
+class AcquisitionWorker(threading.Thread):
+    # polls the feeds on its own thread and queues the new data, so slow FTP
+    # transfers and parsing never block the GUI.
+    # fetch(latest_drone_times, latest_cabauw_time, latest_cabauw_pressure) returns
+    # (dict of drone name -> drone_data, cabauw_data) with only the samples newer than the
+    # given times. with a cache, every result is appended to it together with the feed state.
+    def __init__(self, fetch, interval_s, latest_drone_times=None, latest_cabauw_time=None, latest_cabauw_pressure=None, cache=None):
+        threading.Thread.__init__(self, name='acquisition')
+        self.daemon = True
+        self.fetch = fetch
+        self.cache = cache
+        self.interval_s = interval_s
+        self.latest_drone_times = dict(latest_drone_times or {})
+        self.latest_cabauw_time = latest_cabauw_time
+        self.latest_cabauw_pressure = latest_cabauw_pressure
+        self.results = Queue.Queue()
+        self.tasks = Queue.Queue()
+        self.stopped = threading.Event()
+
+    def submit(self, task):
+        # run task() on the acquisition thread before the next fetch, for state
+        # that the fetch uses (e.g. resetting the drone processor)
+        self.tasks.put(task)
+
+    def stop(self):
+        self.stopped.set()
+
+    def poll_once(self):
+        while not self.tasks.empty():
+            self.tasks.get()()
+
+        with instrument.record('poll'):
+            (drone_data, cabauw_data) = self.fetch(self.latest_drone_times, self.latest_cabauw_time, self.latest_cabauw_pressure)
+        for (name, data) in drone_data.items():
+            if len(data['time']) > 0:
+                self.latest_drone_times[name] = data['time'][-1]
+        if len(cabauw_data['time']) > 0:
+            self.latest_cabauw_time = cabauw_data['time'][-1]
+            self.latest_cabauw_pressure = cabauw_data['air_pressure'][-1]
+        # queued before the cache write, which may fail, as the feeds are not read again for them
+        self.results.put((drone_data, cabauw_data))
+        if self.cache is not None:
+            with instrument.stage('cache'):
+                save(self.cache, dict(drone_data, cabauw=cabauw_data))
+
+    def run(self):
+        while not self.stopped.is_set():
+            started = time.time()
+            try:
+                self.poll_once()
+            except Exception:
+                # a failed poll is retried on the next round
+                traceback.print_exc()
+            self.stopped.wait(max(0, self.interval_s - (time.time() - started)))
+
+    def drain(self):
+        # all results that arrived since the previous call, oldest first
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except Queue.Empty:
+                return results
@@ -0,0 +1,65 @@
+# headless version of the --save-on-refresh autosave: renders the same figure
+# with the Agg backend, without wx, e.g. on a server without a display.
+#
+#   python autosave.py --interval 60 --output-dir /var/www/drone
+import matplotlib
+matplotlib.use('Agg')
+import argparse
+import os
+import time
+import traceback
+import instrument
+from acquisition import AcquisitionWorker, getSensorData, latest_times, levels_cabauw, load_stores, day_cache
+from plots import DronePlot, autosave_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the drone and Cabauw plots to PNG files without a GUI")
+    parser.add_argument("--interval", help="Seconds between refreshes", type=float, default=12.0)
+    parser.add_argument("--overwrite", help="Overwrite one file per day instead of one file per refresh", action="store_true")
+    parser.add_argument("--output-dir", help="Directory for the images", default="autosave")
+    parser.add_argument("--max-rows", help="Only keep the newest MAX_ROWS samples per feed", type=int)
+    parser.add_argument("--size", help="Figure size in inches", type=float, nargs=2, default=(16.0, 9.0), metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--dpi", type=int, default=100)
+    parser.add_argument("--cache-dir", help="Directory for the per day cache of the processed feeds", default="cache")
+    parser.add_argument("--no-cache", help="Fetch the whole day on startup and do not cache it", action="store_true")
+    parser.add_argument("--window", help="Only plot the last WINDOW minutes, the whole day by default", type=float)
+    parser.add_argument("--drone", help="Only plot this drone (see drones.json), can be given more than once, all drones by default", action="append")
+    parser.add_argument("--instrument-log", help="Append the timings of every poll and refresh as json lines to this file")
+    args = parser.parse_args()
+
+    if args.instrument_log:
+        instrument.enable(args.instrument_log)
+
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    cache = None if args.no_cache else day_cache(args.cache_dir)
+    data = load_stores(cache, args.max_rows)
+    plot = DronePlot(data, levels_cabauw, dpi=args.dpi, figsize=args.size)
+    plot.select(args.drone)
+    plot.set_window(None if args.window is None else 60 * args.window)
+
+    acquisition = AcquisitionWorker(getSensorData, args.interval,
+        latest_times(data[0]), data[1].last('time'), data[1].last('air_pressure'), cache)
+    acquisition.start()
+
+    while True:
+        with instrument.record('refresh'):
+            with instrument.stage('append'):
+                for (new_drone_data, new_cabauw_data) in acquisition.drain():
+                    for (name, store) in data[0].items():
+                        store.append(new_drone_data[name])
+                    data[1].append(new_cabauw_data)
+            plot.set_title()
+            with instrument.stage('update'):
+                plot.update()
+            try:
+                plot.save_figure(autosave_path(args.overwrite, args.output_dir))
+            except Exception:
+                # e.g. a full disk, the next refresh tries again
+                traceback.print_exc()
+        time.sleep(args.interval)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# end to end latency against a replayed day (see replay.py): polls the local replay
+# server with getSensorData every --refresh seconds, as the acquisition thread would,
+# and reports how long a poll takes and how old the newest sample is after it.
+#
+#   python -m benchmarks.latency 20170608.txt --speedup 60 --refresh 0.2 --refreshes 100
+#
+# the age is in replayed seconds: the replay clock at the end of the poll minus the time
+# of the newest drone or Cabauw sample in the stores. the day is replayed as the first drone.
+import matplotlib
+matplotlib.use('Agg')
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from timeit import default_timer as timer
+import numpy as np
+import acquisition
+import pyftpbbc
+from benchmarks.replay import add_arguments, start_server
+from data import seconds_since
+from plots import DronePlot
+
+
+def percentiles(values):
+    return [np.percentile(values, p) if len(values) > 0 else 0.0 for p in (50, 95, 100)]
+
+def age(clock, store):
+    if len(store) == 0:
+        return float('nan')
+    return clock.now() - seconds_since(store.last('time'), acquisition.basetime)
+
+def main():
+    parser = argparse.ArgumentParser(description="Poll a replayed day and report the data age and poll latency")
+    add_arguments(parser)
+    parser.add_argument("--refresh", help="Real seconds between polls", type=float, default=1.0)
+    parser.add_argument("--refreshes", help="Number of timed polls", type=int, default=50)
+    parser.add_argument("--draw", help="Also draw the plots after every poll", action="store_true")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+    # the day is served as today, which is where the acquisition looks
+    args.as_date = acquisition.basetime.strftime('%Y%m%d')
+
+    directory = tempfile.mkdtemp(prefix='replay')
+    server = start_server(args, directory)
+    try:
+        for (feed, served) in (('radio', '/radio'), ('cabauw', '/cabauw')):
+            with open(os.path.join(directory, 'ftp_{0}.json'.format(feed)), 'w') as f:
+                json.dump(server.config(served), f)
+        acquisition.drones = acquisition.drones[:1]
+        acquisition.drones[0].config = os.path.join(directory, 'ftp_radio.json')
+        acquisition.drones[0].filename = '%Y%m%d.txt'
+        acquisition.config_cabauw = os.path.join(directory, 'ftp_cabauw.json')
+
+        data = acquisition.load_stores()
+        plot = None
+        if args.draw:
+            plot = DronePlot(data, acquisition.levels_cabauw)
+            plot.attach(plot.canvas)
+            plot.draw_plot(refit=True)
+
+        results = {'latency_ms': [], 'drone_age_s': [], 'cabauw_age_s': []}
+        deadline = time.time()
+        for i in range(args.refreshes):
+            deadline += args.refresh
+            time.sleep(max(0.0, deadline - time.time()))
+            started = timer()
+            (drone_data, cabauw_data) = acquisition.getSensorData(acquisition.latest_times(data[0]), data[1].last('time'), data[1].last('air_pressure'))
+            for (name, store) in data[0].items():
+                store.append(drone_data[name])
+            data[1].append(cabauw_data)
+            if plot is not None:
+                plot.set_title()
+                plot.draw_plot()
+            results['latency_ms'].append(1000 * (timer() - started))
+            results['drone_age_s'].append(age(server.clock, data[0].values()[0]))
+            results['cabauw_age_s'].append(age(server.clock, data[1]))
+    finally:
+        pyftpbbc.close_all()
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(directory)
+
+    print('{0} polls every {1} s at {2}x, {3} drone and {4} Cabauw rows'.format(args.refreshes, args.refresh, args.speedup, len(data[0].values()[0]), len(data[1])))
+    print('{0:<14} {1:>9} {2:>9} {3:>9}'.format('', 'p50', 'p95', 'max'))
+    for name in ('latency_ms', 'drone_age_s', 'cabauw_age_s'):
+        print('{0:<14} {1:>9.1f} {2:>9.1f} {3:>9.1f}'.format(name, *percentiles(results[name])))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'arguments': vars(args), 'results': results}, f, indent=1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+# a stand-in for the BBC FTP server that replays an archived day, for offline end to
+# end tests. the files grow as the replayed day goes on: a clock runs speedup times as
+# fast as real time from --start (the first drone sample by default), and a file shows the lines whose time (the first column,
+# seconds since midnight) has passed, plus the part of the next line that is being written.
+#
+#   python -m benchmarks.replay 20170608.txt --cabauw-dir archive/cabauw --start 11:30 --speedup 60
+#
+# the drone file is served in /radio and the Cabauw files in /cabauw, renamed to the date
+# of --as-date (today by default) so the acquisition finds them. only the commands that
+# pyftpbbc uses are spoken: USER PASS CWD PWD TYPE PASV NLST SIZE MDTM REST RETR NOOP QUIT.
+import argparse
+import json
+import os
+import socket
+import SocketServer
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+
+
+class ReplayClock(object):
+    # seconds since midnight of the replayed day
+    def __init__(self, start_s, speedup=1.0):
+        self.start_s = start_s
+        self.speedup = speedup
+        self.started = time.time()
+
+    def now(self):
+        return self.start_s + self.speedup * (time.time() - self.started)
+
+class ReplayFile(object):
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        lines = self.data.splitlines(True)
+        self.ends = np.cumsum([len(l) for l in lines])
+        secs = []
+        for l in lines:
+            first = l.split(None, 1)
+            secs.append(float(first[0]) if first else (secs[-1] if secs else 0))
+        # out of order lines appear with the line before them
+        self.secs = np.maximum.accumulate(secs) if secs else np.empty(0)
+
+    def size(self, now):
+        # bytes written at now, None before the first line
+        n = np.searchsorted(self.secs, now, side='right')
+        if n == 0:
+            return None
+        if n == len(self.secs):
+            return len(self.data)
+        # the next line is written proportionally to the time until it is due
+        (start, stop) = (self.ends[n - 1], self.ends[n])
+        fraction = (now - self.secs[n - 1]) / max(1.0, self.secs[n] - self.secs[n - 1])
+        return int(start + fraction * (stop - start))
+
+    def mdtm(self, now, date):
+        size = self.size(now)
+        last = self.secs[-1] if size == len(self.data) else now
+        return (date + timedelta(seconds=int(last))).strftime('%Y%m%d%H%M%S')
+
+class ReplayHandler(SocketServer.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line + '\r\n')
+        self.wfile.flush()
+
+    def handle(self):
+        self.cwd = '/'
+        self.rest = 0
+        self.passive = None
+        self.reply('220 replay server ready')
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    break
+                (command, arg) = (line.strip().split(' ', 1) + [''])[:2]
+                method = getattr(self, 'ftp_' + command.upper(), None)
+                if method is None:
+                    self.reply('502 {0} not implemented'.format(command))
+                elif method(arg) is False:
+                    break
+        finally:
+            if self.passive is not None:
+                self.passive.close()
+
+    def file(self, name):
+        return self.server.dirs.get(self.cwd, {}).get(name)
+
+    def data_connection(self):
+        if self.passive is None:
+            self.reply('425 use PASV first')
+            return None
+        (conn, address) = self.passive.accept()
+        self.passive.close()
+        self.passive = None
+        return conn
+
+    def ftp_USER(self, arg):
+        self.reply('331 password please')
+
+    def ftp_PASS(self, arg):
+        self.reply('230 logged in')
+
+    def ftp_CWD(self, arg):
+        path = '/' + arg.strip('/')
+        if path not in self.server.dirs and path != '/':
+            self.reply('550 no such directory')
+            return
+        self.cwd = path
+        self.reply('250 directory changed')
+
+    def ftp_PWD(self, arg):
+        self.reply('257 "{0}"'.format(self.cwd))
+
+    def ftp_TYPE(self, arg):
+        self.reply('200 type set to ' + arg)
+
+    def ftp_NOOP(self, arg):
+        self.reply('200 ok')
+
+    def ftp_QUIT(self, arg):
+        self.reply('221 bye')
+        return False
+
+    def ftp_PASV(self, arg):
+        if self.passive is not None:
+            self.passive.close()
+        self.passive = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.passive.bind((self.server.server_address[0], 0))
+        self.passive.listen(1)
+        (host, port) = self.passive.getsockname()
+        self.reply('227 Entering Passive Mode ({0},{1},{2})'.format(host.replace('.', ','), port // 256, port % 256))
+
+    def ftp_NLST(self, arg):
+        now = self.server.clock.now()
+        names = sorted(name for (name, f) in self.server.dirs.get(self.cwd, {}).items() if f.size(now) is not None)
+        conn = self.data_connection()
+        if conn is None:
+            return
+        self.reply('150 listing')
+        conn.sendall(''.join(name + '\r\n' for name in names))
+        conn.close()
+        self.reply('226 listing sent')
+
+    def ftp_SIZE(self, arg):
+        f = self.file(arg)
+        size = f.size(self.server.clock.now()) if f is not None else None
+        if size is None:
+            self.reply('550 no such file')
+            return
+        self.reply('213 {0}'.format(size))
+
+    def ftp_MDTM(self, arg):
+        f = self.file(arg)
+        now = self.server.clock.now()
+        if f is None or f.size(now) is None:
+            self.reply('550 no such file')
+            return
+        self.reply('213 ' + f.mdtm(now, self.server.date))
+
+    def ftp_REST(self, arg):
+        self.rest = int(arg)
+        self.reply('350 restarting at {0}'.format(self.rest))
+
+    def ftp_RETR(self, arg):
+        (rest, self.rest) = (self.rest, 0)
+        f = self.file(arg)
+        size = f.size(self.server.clock.now()) if f is not None else None
+        if size is None:
+            self.reply('550 no such file')
+            return
+        if rest > size:
+            self.reply('554 restart offset past the end of the file')
+            return
+        conn = self.data_connection()
+        if conn is None:
+            return
+        self.reply('150 sending {0} bytes'.format(size - rest))
+        for start in range(rest, size, self.server.blocksize):
+            conn.sendall(f.data[start:min(size, start + self.server.blocksize)])
+        conn.close()
+        self.reply('226 transfer complete')
+
+class ReplayServer(SocketServer.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, radio, cabauw, clock, date, blocksize=8192):
+        # radio: the ReplayFile of the drone file, cabauw: paths of the archived Cabauw files
+        # of the same day, whose names start with its date
+        SocketServer.ThreadingTCPServer.__init__(self, address, ReplayHandler)
+        self.clock = clock
+        self.date = date
+        self.blocksize = blocksize
+        stamp = date.strftime('%Y%m%d')
+        self.dirs = {'/radio': {stamp + '.txt': radio}, '/cabauw': {}}
+        for path in cabauw:
+            name = os.path.basename(path)
+            self.dirs['/cabauw'][stamp + name[8:]] = ReplayFile(path)
+
+    def config(self, directory):
+        # a pyftpbbc config for one of the served directories
+        (host, port) = self.server_address
+        return {'ftp': {'server': host, 'port': port, 'user': 'replay', 'password': 'replay', 'dir': directory}}
+
+def parse_time(hhmm):
+    (hours, minutes) = hhmm.split(':')
+    return int(hours) * 3600 + int(minutes) * 60
+
+def add_arguments(parser):
+    parser.add_argument("radio", help="Archived drone file, e.g. 20170608.txt")
+    parser.add_argument("--cabauw-dir", help="Directory with the archived Cabauw files of that day, synthetic ones by default")
+    parser.add_argument("--start", help="Time of day the replay starts at, HH:MM, the first drone sample by default")
+    parser.add_argument("--speedup", help="How much faster than real time the day is replayed", type=float, default=1.0)
+    parser.add_argument("--as-date", help="Date to serve the day as, YYYYMMDD, today by default")
+
+def cabauw_files(args, radio, directory):
+    # the archived Cabauw files of the replayed day, or synthetic ones written to directory
+    day = os.path.basename(args.radio)[:8]
+    if args.cabauw_dir is not None:
+        return sorted(os.path.join(args.cabauw_dir, f) for f in os.listdir(args.cabauw_dir) if f.startswith(day))
+    from benchmarks.synthetic import cabauw_text
+    metadata_cabauw = json.loads(open('metadata_cab.json').read())['metadata']['columns']
+    (start, stop) = (int(radio.secs[0]) // 3600 * 3600, int(radio.secs[-1]))
+    path = os.path.join(directory, day + '_cabauw.txt')
+    with open(path, 'w') as f:
+        f.write(cabauw_text(metadata_cabauw, start, stop - start, 60.0))
+    return [path]
+
+def start_server(args, directory, port=0):
+    # a running ReplayServer for the parsed arguments, on its own thread
+    date = datetime.strptime(args.as_date, '%Y%m%d') if args.as_date else datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    radio = ReplayFile(args.radio)
+    start = parse_time(args.start) if args.start else radio.secs[0]
+    server = ReplayServer(('127.0.0.1', port), radio, cabauw_files(args, radio, directory), ReplayClock(start, args.speedup), date)
+    thread = threading.Thread(target=server.serve_forever, name='replay-server')
+    thread.daemon = True
+    thread.start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay an archived day on a local FTP server")
+    add_arguments(parser)
+    parser.add_argument("--port", type=int, default=2121)
+    parser.add_argument("--config-dir", help="Where to write ftp_radio.json and ftp_cabauw.json for the server", default="replay")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.config_dir):
+        os.makedirs(args.config_dir)
+    server = start_server(args, args.config_dir, args.port)
+    for (name, directory) in (('ftp_radio.json', '/radio'), ('ftp_cabauw.json', '/cabauw')):
+        with open(os.path.join(args.config_dir, name), 'w') as f:
+            json.dump(server.config(directory), f)
+    print('replaying {0} at {1}x on port {2}, configs in {3}'.format(args.radio, args.speedup, server.server_address[1], args.config_dir))
+    while True:
+        time.sleep(60)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+# throughput, peak memory and refresh latency of the parsing, processing and
+# plotting stages, on synthetic feeds (see synthetic.py).
+#
+#   python -m benchmarks.run --duration day --rate 1
+#   python -m benchmarks.run --duration week --rate 10 --only parse_radio process_drone --json week10.json
+#
+# cold benchmarks load the whole period at once. incremental benchmarks load all but the
+# last --refreshes refreshes and time those one by one, as the GUI timer would.
+# the feeds are generated once, up front, and every benchmark runs in a process of its own
+# that reads only the feeds it uses. the peak memory is how far the benchmark raised that
+# process above what it used before it started.
+import matplotlib
+matplotlib.use('Agg')
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import traceback
+from datetime import datetime
+from timeit import default_timer as timer
+import numpy as np
+from benchmarks.synthetic import radio_text, cabauw_text
+from columns import ColumnStore
+from data import parse_radio_data, parse_cabauw_data, process_drone_data, process_cabauw_data, DroneProcessor, cabauw_levels
+from meteo import calculate_height
+from plots import DronePlot
+
+DURATIONS = {'hour': 3600, 'day': 86400, 'week': 7 * 86400, 'month': 30 * 86400}
+BASETIME = datetime(2017, 6, 8)
+START_S = 4 * 3600
+
+
+def split_lines(text, count):
+    # text in chunks of count lines
+    lines = text.splitlines(True)
+    return [''.join(lines[i:i + count]) for i in range(0, len(lines), count)]
+
+def write_feeds(args, directory):
+    # generates the synthetic drone and Cabauw text of the run into directory, see Feeds
+    metadata_cabauw = json.loads(open('metadata_cab.json').read())['metadata']['columns']
+    duration_s = DURATIONS[args.duration]
+    with open(os.path.join(directory, 'radio.txt'), 'wb') as f:
+        f.write(radio_text(START_S, duration_s, args.rate))
+    with open(os.path.join(directory, 'cabauw.txt'), 'wb') as f:
+        f.write(cabauw_text(metadata_cabauw, START_S, duration_s, args.cabauw_interval))
+
+class Feeds(object):
+    # the synthetic drone and Cabauw text of one benchmark run, read from the files of
+    # write_feeds when a benchmark first uses them
+    def __init__(self, args, directory):
+        self.args = args
+        self.directory = directory
+        self.metadata_radio = json.loads(open('metadata_radio.json').read())['metadata']['columns']
+        self.metadata_cabauw = json.loads(open('metadata_cab.json').read())['metadata']['columns']
+        self._text = {}
+
+    def _read(self, feed):
+        if feed not in self._text:
+            with open(os.path.join(self.directory, feed + '.txt'), 'rb') as f:
+                self._text[feed] = f.read()
+        return self._text[feed]
+
+    @property
+    def radio(self):
+        return self._read('radio')
+
+    @property
+    def cabauw(self):
+        return self._read('cabauw')
+
+    @property
+    def radio_rows(self):
+        return self.radio.count('\n')
+
+    @property
+    def cabauw_rows(self):
+        return self.cabauw.count('\n')
+
+    def refreshes(self):
+        # (drone, cabauw) text per refresh, the cabauw feed gets at least a row per refresh
+        radio = split_lines(self.radio, max(1, int(self.args.refresh * self.args.rate)))
+        cabauw = split_lines(self.cabauw, max(1, int(self.args.refresh / self.args.cabauw_interval)))
+        count = min(len(radio), len(cabauw))
+        return radio[:count], cabauw[:count]
+
+    def split(self):
+        # (drone, cabauw) text loaded before the timed refreshes, and the refreshes
+        (radio, cabauw) = self.refreshes()
+        n = min(self.args.refreshes, len(radio) - 1)
+        return (''.join(radio[:-n]), ''.join(cabauw[:-n])), zip(radio[-n:], cabauw[-n:])
+
+
+def bench_parse_radio(feeds):
+    started = timer()
+    parse_radio_data(feeds.radio, feeds.metadata_radio, BASETIME, None)
+    return {'rows': feeds.radio_rows, 'seconds': timer() - started}
+
+def bench_parse_cabauw(feeds):
+    started = timer()
+    parse_cabauw_data(feeds.cabauw, feeds.metadata_cabauw, BASETIME, None)
+    return {'rows': feeds.cabauw_rows, 'seconds': timer() - started}
+
+def bench_calculate_height(feeds):
+    (time, air_pressure, temperature, rel_hum, height) = parse_radio_data(feeds.radio, feeds.metadata_radio, BASETIME, None)
+    started = timer()
+    calculate_height(air_pressure, temperature, rel_hum, air_pressure[0])
+    return {'rows': len(air_pressure), 'seconds': timer() - started}
+
+def bench_process_drone(feeds):
+    started = timer()
+    process_drone_data(feeds.radio, BASETIME, feeds.metadata_radio, 1013.0, None)
+    return {'rows': feeds.radio_rows, 'seconds': timer() - started}
+
+def bench_process_cabauw(feeds):
+    started = timer()
+    process_cabauw_data(feeds.cabauw, BASETIME, feeds.metadata_cabauw, None)
+    return {'rows': feeds.cabauw_rows, 'seconds': timer() - started}
+
+def bench_process_incremental(feeds):
+    ((radio, cabauw), refreshes) = feeds.split()
+    processor = DroneProcessor(feeds.metadata_radio)
+    drone_data = processor.process(radio, BASETIME, 1013.0, None)
+    cabauw_data = process_cabauw_data(cabauw, BASETIME, feeds.metadata_cabauw, None)
+    latest = (drone_data['time'][-1], cabauw_data['time'][-1], cabauw_data['air_pressure'][-1])
+    latencies = []
+    rows = 0
+    for (radio, cabauw) in refreshes:
+        started = timer()
+        cabauw_data = process_cabauw_data(cabauw, BASETIME, feeds.metadata_cabauw, latest[1])
+        drone_data = processor.process(radio, BASETIME, cabauw_data['air_pressure'][-1], latest[0])
+        latencies.append(timer() - started)
+        latest = (drone_data['time'][-1], cabauw_data['time'][-1], cabauw_data['air_pressure'][-1])
+        rows += len(drone_data['time']) + len(cabauw_data['time'])
+    return {'rows': rows, 'seconds': sum(latencies), 'latencies': latencies}
+
+def processed_stores(feeds, radio, cabauw):
+    drone_data = process_drone_data(radio, BASETIME, feeds.metadata_radio, 1013.0, None)
+    cabauw_data = process_cabauw_data(cabauw, BASETIME, feeds.metadata_cabauw, None)
+    return ({'drone': ColumnStore(drone_data)}, ColumnStore(cabauw_data))
+
+def bench_draw_cold(feeds):
+    data = processed_stores(feeds, feeds.radio, feeds.cabauw)
+    started = timer()
+    plot = DronePlot(data, cabauw_levels(feeds.metadata_cabauw), figsize=feeds.args.size)
+    plot.attach(plot.canvas)
+    plot.set_window(None if feeds.args.window is None else 60 * feeds.args.window)
+    plot.draw_plot(refit=True)
+    return {'rows': len(data[0]['drone']) + len(data[1]), 'seconds': timer() - started}
+
+def bench_draw_incremental(feeds):
+    ((radio, cabauw), refreshes) = feeds.split()
+    data = processed_stores(feeds, radio, cabauw)
+    plot = DronePlot(data, cabauw_levels(feeds.metadata_cabauw), figsize=feeds.args.size)
+    plot.attach(plot.canvas)
+    plot.set_window(None if feeds.args.window is None else 60 * feeds.args.window)
+    plot.draw_plot(refit=True)
+    processor = DroneProcessor(feeds.metadata_radio)
+    # only the refreshes are processed here, the height integration starts over
+    # which does not matter for the timing
+    latencies = []
+    rows = 0
+    for (radio, cabauw) in refreshes:
+        cabauw_data = process_cabauw_data(cabauw, BASETIME, feeds.metadata_cabauw, data[1].last('time'))
+        drone_data = processor.process(radio, BASETIME, data[1].last('air_pressure'), data[0]['drone'].last('time'))
+        started = timer()
+        data[0]['drone'].append(drone_data)
+        data[1].append(cabauw_data)
+        plot.set_title()
+        plot.draw_plot()
+        latencies.append(timer() - started)
+        rows += len(drone_data['time']) + len(cabauw_data['time'])
+    return {'rows': rows, 'seconds': sum(latencies), 'latencies': latencies}
+
+BENCHMARKS = [
+    ('parse_radio', bench_parse_radio),
+    ('parse_cabauw', bench_parse_cabauw),
+    ('calculate_height', bench_calculate_height),
+    ('process_drone', bench_process_drone),
+    ('process_cabauw', bench_process_cabauw),
+    ('process_incremental', bench_process_incremental),
+    ('draw_cold', bench_draw_cold),
+    ('draw_incremental', bench_draw_incremental),
+]
+
+
+def child(bench, args, directory, results):
+    try:
+        # kilobytes on linux
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result = bench(Feeds(args, directory))
+        result['peak_mb'] = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024.0
+        results.put(result)
+    except Exception:
+        results.put({'error': traceback.format_exc()})
+
+def run(name, bench, args, directory):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=child, args=(bench, args, directory, results))
+    process.start()
+    result = results.get()
+    process.join()
+    result['name'] = name
+    if 'latencies' in result:
+        latencies = np.multiply(1000.0, result.pop('latencies'))
+        result['refreshes'] = len(latencies)
+        for p in (50, 95, 100):
+            result['p{0}_ms'.format(p)] = np.percentile(latencies, p) if len(latencies) > 0 else 0.0
+    if 'seconds' in result:
+        result['rows_per_s'] = result['rows'] / result['seconds'] if result['seconds'] > 0 else float('inf')
+    return result
+
+def report(result):
+    if 'error' in result:
+        print('{0:<20} failed\n{1}'.format(result['name'], result['error']))
+        return
+    latency = ''
+    if 'refreshes' in result:
+        latency = '{p50_ms:>9.1f} {p95_ms:>9.1f} {p100_ms:>9.1f}'.format(**result)
+    print('{name:<20} {rows:>10d} {seconds:>9.3f} {rows_per_s:>12.0f} {peak_mb:>8.1f} '.format(**result) + latency)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the drone and Cabauw pipeline on synthetic feeds")
+    parser.add_argument("--duration", help="Length of the synthetic feeds", choices=sorted(DURATIONS, key=DURATIONS.get), default="day")
+    parser.add_argument("--rate", help="Drone samples per second", type=float, default=1.0)
+    parser.add_argument("--cabauw-interval", help="Seconds between Cabauw rows", type=float, default=60.0)
+    parser.add_argument("--refresh", help="Seconds between refreshes", type=float, default=12.0)
+    parser.add_argument("--refreshes", help="Number of timed refreshes in the incremental benchmarks", type=int, default=50)
+    parser.add_argument("--window", help="Only draw the last WINDOW minutes in the draw benchmarks", type=float)
+    parser.add_argument("--size", help="Figure size in inches", type=float, nargs=2, default=(16.0, 9.0), metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--only", help="Only run these benchmarks", nargs='+', choices=[name for (name, bench) in BENCHMARKS])
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    print('{0} at {1} Hz, Cabauw every {2} s, refresh every {3} s'.format(args.duration, args.rate, args.cabauw_interval, args.refresh))
+    print('{0:<20} {1:>10} {2:>9} {3:>12} {4:>8} {5:>9} {6:>9} {7:>9}'.format('benchmark', 'rows', 'seconds', 'rows/s', 'peak MB', 'p50 ms', 'p95 ms', 'max ms'))
+    directory = tempfile.mkdtemp(prefix='feeds')
+    results = []
+    try:
+        write_feeds(args, directory)
+        for (name, bench) in BENCHMARKS:
+            if args.only and name not in args.only:
+                continue
+            results.append(run(name, bench, args, directory))
+            report(results[-1])
+    finally:
+        shutil.rmtree(directory)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'arguments': vars(args), 'results': results}, f, indent=1)
+
+if __name__ == '__main__':
+    main()
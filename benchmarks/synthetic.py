@@ -0,0 +1,93 @@
+# synthetic drone and Cabauw files in the formats the BBC server delivers,
+# for benchmarks and offline runs.
+#
+#   python -m benchmarks.synthetic archive --start 20170608 --days 7 --rate 10
+#
+# writes archive/YYYYMMDD.txt (drone) and archive/cabauw/YYYYMMDD_HH.txt per day.
+import argparse
+import json
+import os
+import StringIO
+from datetime import datetime, timedelta
+import numpy as np
+from data import cabauw_layout, cabauw_levels
+
+RADIO_FORMAT = '%6d%8.2f%8.2f%8.2f%6d'
+CABAUW_FORMATS = {'wind_directions': '%.1f', 'relative_humidities': '%d', 'visibilities': '%d'}
+# flights of 10 minutes up to 200 m and back
+FLIGHT_S = 600.0
+
+
+def radio_rows(start_s, duration_s, rate_hz=1.0, seed=0):
+    # (seconds, pressure, temperature, relative humidity, GPS height) columns
+    rng = np.random.RandomState(seed)
+    n = int(duration_s * rate_hz)
+    elapsed = np.arange(n) / float(rate_hz)
+    secs = (start_s + elapsed).astype(np.int64)
+    phase = (elapsed % FLIGHT_S) / FLIGHT_S
+    height = np.clip(200.0 * (1 - abs(2 * phase - 1)) + rng.normal(0, 2, n), 0, None)
+    pressure = 1013.0 - height / 8.3 + rng.normal(0, 0.05, n)
+    # warming during the morning, a stable layer near the ground
+    temperature = 14.0 + 6.0 * (secs % 86400) / 86400.0 + 0.01 * height + rng.normal(0, 0.2, n)
+    rel_hum = np.clip(80.0 - 0.1 * height + rng.normal(0, 1, n), 1, 100)
+    return secs, pressure, temperature, rel_hum, height
+
+def radio_text(start_s, duration_s, rate_hz=1.0, seed=0):
+    # the same layout as 20170608.txt
+    sio = StringIO.StringIO()
+    np.savetxt(sio, np.column_stack(radio_rows(start_s, duration_s, rate_hz, seed)), fmt=RADIO_FORMAT)
+    return sio.getvalue()
+
+def cabauw_text(metadata, start_s, duration_s, interval_s=60.0, nan_fraction=0.01, seed=0):
+    # token layout described by metadata_cab.json, one row per interval_s
+    rng = np.random.RandomState(seed)
+    levels = np.array(cabauw_levels(metadata), dtype=float)
+    secs = (start_s + np.arange(0, duration_s, interval_s)).astype(np.int64)
+    n = len(secs)
+    ranges = {
+        'wind_speeds': lambda: 2.0 + 0.03 * levels + rng.uniform(0, 3, (n, len(levels))),
+        'wind_directions': lambda: rng.uniform(180, 270, (n, len(levels))),
+        'air_temperatures': lambda: 15.0 - 0.005 * levels + rng.normal(0, 0.3, (n, len(levels))),
+        'dew_point_temperatures': lambda: 9.0 - 0.004 * levels + rng.normal(0, 0.3, (n, len(levels))),
+        'relative_humidities': lambda: rng.uniform(60, 95, (n, len(levels))),
+        'visibilities': lambda: rng.uniform(2000, 9000, (n, len(levels))),
+        'air_pressure': lambda: 1013.0 + rng.normal(0, 0.2, (n, 1)),
+    }
+    columns = np.empty((n, len(metadata)), dtype=object)
+    columns[:, 0] = secs.astype(str)
+    for (variable, token_idx, token, value_columns) in cabauw_layout(metadata):
+        columns[:, token_idx] = token or 'pr'
+        columns[:, value_columns] = np.char.mod(CABAUW_FORMATS.get(variable, '%.2f'), ranges[variable]())
+    missing = rng.uniform(size=n) < nan_fraction
+    columns[missing, 2] = 'NAN'
+    return ''.join(' '.join(row) + '\n' for row in columns)
+
+def write_day(directory, day, metadata_cabauw, rate_hz=1.0, start_s=4 * 3600, duration_s=8 * 3600, cabauw_interval_s=60.0, cabauw_files=8, seed=0):
+    # one archived day: the drone file and cabauw_files Cabauw files splitting the period
+    if not os.path.isdir(os.path.join(directory, 'cabauw')):
+        os.makedirs(os.path.join(directory, 'cabauw'))
+    stamp = day.strftime('%Y%m%d')
+    with open(os.path.join(directory, stamp + '.txt'), 'w') as f:
+        f.write(radio_text(start_s, duration_s, rate_hz, seed))
+    part_s = duration_s / float(cabauw_files)
+    for i in range(cabauw_files):
+        part_start = start_s + i * part_s
+        with open(os.path.join(directory, 'cabauw', '{0}_{1:02d}.txt'.format(stamp, int(part_start // 3600))), 'a') as f:
+            f.write(cabauw_text(metadata_cabauw, part_start, part_s, cabauw_interval_s, seed=seed + i))
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic archived days")
+    parser.add_argument("directory")
+    parser.add_argument("--start", help="First day, YYYYMMDD", default="20170608")
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--rate", help="Drone samples per second", type=float, default=1.0)
+    parser.add_argument("--cabauw-interval", help="Seconds between Cabauw rows", type=float, default=60.0)
+    args = parser.parse_args()
+
+    metadata_cabauw = json.loads(open('metadata_cab.json').read())['metadata']['columns']
+    first = datetime.strptime(args.start, '%Y%m%d')
+    for d in range(args.days):
+        write_day(args.directory, first + timedelta(days=d), metadata_cabauw, args.rate, cabauw_interval_s=args.cabauw_interval, seed=d)
+
+if __name__ == '__main__':
+    main()
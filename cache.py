@@ -0,0 +1,100 @@
+# a day of processed feeds on disk: one raw binary file per column, plus an index.json
+# with the number of rows, the dtype and row shape of every column and the state needed
+# to continue tailing the server.
+#
+#   cache/20170608/index.json
+#   cache/20170608/drone.time.bin, drone.temperature.bin, ...
+#   cache/20170608/cabauw.wind_speeds.bin, ...
+#
+# columns are memory mapped on load, so a day opens without reading it, and new rows
+# are appended to the files. the index is rewritten after the columns, bytes past the
+# rows in the index (e.g. from an interrupted append) are cut off on the next append.
+import copy
+import json
+import os
+import numpy as np
+
+
+class DayCache(object):
+    def __init__(self, directory):
+        self.directory = directory
+        path = os.path.join(directory, 'index.json')
+        if os.path.exists(path):
+            with open(path) as f:
+                self.index = json.load(f)
+        else:
+            self.index = {'feeds': {}, 'state': None}
+
+    @property
+    def state(self):
+        return self.index['state']
+
+    def feeds(self):
+        return self.index['feeds'].keys()
+
+    def rows(self, feed):
+        return self.index['feeds'][feed]['rows'] if feed in self.index['feeds'] else 0
+
+    def _path(self, feed, column):
+        return os.path.join(self.directory, '{0}.{1}.bin'.format(feed, column))
+
+    def load(self, feed, mmap=True):
+        # dict of column -> array, memory mapped read only unless mmap is False
+        layout = self.index['feeds'].get(feed)
+        if layout is None:
+            return {}
+        columns = {}
+        for (column, (dtype, shape)) in layout['columns'].items():
+            shape = (layout['rows'],) + tuple(shape)
+            if layout['rows'] == 0:
+                columns[column] = np.empty(shape, dtype=dtype)
+            elif mmap:
+                columns[column] = np.memmap(self._path(feed, column), dtype=dtype, mode='r', shape=shape)
+            else:
+                columns[column] = np.fromfile(self._path(feed, column), dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+        return columns
+
+    def append(self, feeds, state=None):
+        # feeds: dict of feed -> dict of column -> values, state: anything json can store
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # when a write fails the index is left as it was, so the same rows can be appended again
+        index = copy.deepcopy(self.index)
+        try:
+            self._append(feeds, state)
+        except:
+            self.index = index
+            raise
+
+    def _append(self, feeds, state):
+        for (feed, columns) in feeds.items():
+            columns = dict((k, np.asarray(v)) for (k, v) in columns.items())
+            rows = max([len(v) for v in columns.values()] or [0])
+            if rows == 0:
+                continue
+            layout = self.index['feeds'].setdefault(feed, {'rows': 0, 'columns': {}})
+            if layout['columns'] and set(columns) != set(layout['columns']):
+                raise KeyError('Expected columns {0}, got {1}'.format(sorted(layout['columns']), sorted(columns)))
+            for (column, values) in columns.items():
+                dtype, shape = layout['columns'].setdefault(column, [values.dtype.str, list(values.shape[1:])])
+                values = np.ascontiguousarray(values, dtype=dtype)
+                path = self._path(feed, column)
+                expected = layout['rows'] * values.dtype.itemsize * int(np.prod(shape))
+                if os.path.exists(path) and os.path.getsize(path) != expected:
+                    with open(path, 'r+b') as f:
+                        f.truncate(expected)
+                with open(path, 'ab') as f:
+                    values.tofile(f)
+            layout['rows'] += rows
+        if state is not None:
+            self.index['state'] = state
+        self._write_index()
+
+    def _write_index(self):
+        path = os.path.join(self.directory, 'index.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.index, f)
+        if os.name == 'nt' and os.path.exists(path):
+            # rename does not replace on windows
+            os.remove(path)
+        os.rename(path + '.tmp', path)
@@ -0,0 +1,105 @@
+import numpy as np
+
+
+class ColumnStore(object):
+    # named columns that grow along the first axis. the buffers double their
+    # capacity when they are full, so appending costs O(new rows), and reading
+    # a column returns a view of the filled part without copying.
+    # with max_rows set only the newest max_rows rows are kept, for live sessions
+    # that should not grow without bound. appended counts every row ever appended, so
+    # appended - len(store) is the number of the oldest row that is kept.
+    def __init__(self, columns=None, max_rows=None, capacity=1024):
+        self.max_rows = max_rows
+        self.capacity = capacity
+        self.start = 0
+        self.stop = 0
+        self.appended = 0
+        self.buffers = {}
+        if columns is not None:
+            self.append(columns)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __contains__(self, key):
+        return key in self.buffers
+
+    def __getitem__(self, key):
+        return self.buffers[key][self.start:self.stop]
+
+    def keys(self):
+        return self.buffers.keys()
+
+    def last(self, key, default=None):
+        # the newest value of a column, default when there is none
+        if key not in self.buffers or len(self) == 0:
+            return default
+        return self.buffers[key][self.stop - 1]
+
+    def as_dict(self):
+        return dict((k, self[k]) for k in self.buffers)
+
+    def rows_between(self, start=None, stop=None, key='time'):
+        # the slice of the rows with start <= key < stop, by binary search on the sorted
+        # column key. None leaves that side open
+        if key not in self.buffers:
+            return slice(0, 0)
+        column = self[key]
+        lower = 0 if start is None else np.searchsorted(column, np.asarray(start, dtype=column.dtype), side='left')
+        upper = len(column) if stop is None else np.searchsorted(column, np.asarray(stop, dtype=column.dtype), side='left')
+        return slice(int(lower), int(max(lower, upper)))
+
+    def window(self, start=None, stop=None, levels=None, key='time'):
+        # dict of name -> the rows with start <= key < stop, as views. levels picks along the
+        # second axis of the (time x level) columns, a slice keeps those views too
+        rows = self.rows_between(start, stop, key)
+        columns = {}
+        for k in self.buffers:
+            column = self[k][rows]
+            if levels is not None and column.ndim > 1:
+                column = column[:, levels]
+            columns[k] = column
+        return columns
+
+    def _reserve(self, rows):
+        # make sure rows more rows fit behind self.stop
+        if self.stop + rows <= self.capacity:
+            return
+        live = self.stop - self.start
+        capacity = self.capacity
+        while live + rows > capacity:
+            capacity *= 2
+        for (k, buf) in self.buffers.items():
+            grown = np.empty((capacity,) + buf.shape[1:], dtype=buf.dtype)
+            grown[:live] = buf[self.start:self.stop]
+            self.buffers[k] = grown
+        self.capacity = capacity
+        self.start = 0
+        self.stop = live
+
+    def append(self, columns):
+        # columns: dict of name -> values, all with the same number of rows
+        columns = dict((k, np.asarray(v)) for (k, v) in columns.items())
+        rows = max([len(v) for v in columns.values()] or [0])
+        if rows == 0:
+            return
+        appended = rows
+        if self.max_rows is not None and rows > self.max_rows:
+            columns = dict((k, v[-self.max_rows:]) for (k, v) in columns.items())
+            rows = self.max_rows
+
+        for (k, v) in columns.items():
+            if k not in self.buffers:
+                if len(self) > 0:
+                    raise KeyError('Cannot add column {0!r} to a store that already has rows'.format(k))
+                self.buffers[k] = np.empty((self.capacity,) + v.shape[1:], dtype=v.dtype)
+        if set(columns) != set(self.buffers):
+            raise KeyError('Expected columns {0}, got {1}'.format(sorted(self.buffers), sorted(columns)))
+
+        self._reserve(rows)
+        for (k, v) in columns.items():
+            self.buffers[k][self.stop:self.stop + rows] = v
+        self.stop += rows
+        self.appended += appended
+        if self.max_rows is not None and len(self) > self.max_rows:
+            self.start = self.stop - self.max_rows
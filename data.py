@@ -2,8 +2,9 @@ import numpy as np
 from datetime import timedelta, datetime
 import matplotlib
 import json
-from itertools import izip_longest
-from meteo import calculate_height, getTheta, get_mixing_ratio
+import re
+import instrument
+from meteo import calculate_height, get_mixing_ratio, theta_at
 
 # plotting stuff
 def filter_time(time):
@@ -21,38 +22,72 @@ def clean_data(data, basetime):
 	arr[0] = list(map(lambda x: basetime + timedelta(seconds=x), arr[0]))
 	return np.array(arr)
 
-def grouper(n, iterable, fillvalue=None):
-    "grouper(3, 'ABCDEFG', 'x') --> ABC DEF Gxx"
-    args = [iter(iterable)] * n
-    return izip_longest(fillvalue=fillvalue, *args)
+def to_datetime64(seconds, basetime):
+	# seconds since basetime -> datetime64[s] array
+	return np.datetime64(basetime, 's') + np.asarray(seconds, dtype=np.int64).astype('timedelta64[s]')
+
+def seconds_since(time, basetime):
+	# time (a datetime or datetime64) as whole seconds since basetime
+	return (np.datetime64(time, 's') - np.datetime64(basetime, 's')).astype(np.int64)
+
+def radio_columns(data, metadata):
+	# read the whitespace separated buffer into a (rows x columns) float block in one pass.
+	# the files on the server can have fewer columns than metadata_radio.json declares
+	# (no lat/lon), so the column count is taken from the first line.
+	data = data.lstrip()
+	ncols = len(data.split('\n', 1)[0].split()) or len(metadata)
+	if not data:
+		return np.empty((0, ncols))
+	values = np.fromstring(data, sep=' ')
+	# drop a trailing incomplete row
+	nrows = len(values) // ncols
+	return values[:nrows * ncols].reshape(nrows, ncols)
+
+class ChunkParser(object):
+	# parses a feed while it is transferred: feed() takes the complete lines of every chunk
+	# that arrives (pyftpbbc.FileTail carries an incomplete last line over to the next chunk)
+	# and parses them into a float row block with parse(lines, metadata) right away, so the
+	# raw text of a transfer is never held in full. the parse_* functions accept a
+	# ChunkParser in place of the text.
+	def __init__(self, parse, metadata):
+		self.parse = parse
+		self.metadata = metadata
+		self.blocks = []
+		self.rows = 0
+
+	def feed(self, lines):
+		if lines:
+			self.blocks.append(self.parse(lines, self.metadata))
+			self.rows += len(self.blocks[-1])
+
+	def block(self):
+		# all rows parsed so far
+		if not self.blocks:
+			return self.parse('', self.metadata)
+		if len(self.blocks) > 1:
+			self.blocks = [np.concatenate(self.blocks)]
+		return self.blocks[0]
 
 def parse_radio_data(data, metadata, basetime, latest_time):
-	time = np.array([])
-	air_pressure = np.array([])
-	temperature = np.array([])
-	rel_hum = np.array([])
-	height = np.array([])
-
-	data = data.split()
-	splitted = list(grouper(len(metadata), data))
-
-	for line in splitted:
-		t, pres, temp, rela_hum, h, lat, lon = line
-		t_mapped = basetime + timedelta(seconds=int(t))
-		if int(t) > 0 and (latest_time is None or t_mapped > latest_time):
-			time = np.append(time, np.array(t_mapped))
-			air_pressure = np.append(air_pressure, np.array(float(pres)))
-			temperature = np.append(temperature, np.array(float(temp)))
-			rel_hum = np.append(rel_hum, np.array(float(rela_hum)))
-			height = np.append(height, np.array(int(h)))
-	
-	dirty_indices = filter_time(time)
-	time = np.delete(time, dirty_indices)
-	air_pressure = np.delete(air_pressure, dirty_indices)
-	temperature = np.delete(temperature, dirty_indices)
-	rel_hum = np.delete(rel_hum, dirty_indices)
-	height = np.delete(height, dirty_indices)
-	# time = list(map(lambda x: basetime + timedelta(seconds=x) , time))
+	block = data.block() if isinstance(data, ChunkParser) else radio_columns(data, metadata)
+	secs = block[:, 0].astype(np.int64)
+
+	keep = secs > 0
+	if latest_time is not None:
+		keep &= secs > seconds_since(latest_time, basetime)
+	block = block[keep]
+	secs = secs[keep]
+
+	# same rule as filter_time: drop every sample that is older than its predecessor
+	ordered = np.ones(len(secs), dtype=bool)
+	ordered[1:] = secs[:-1] <= secs[1:]
+	block = block[ordered]
+
+	time = to_datetime64(secs[ordered], basetime)
+	air_pressure = block[:, 1]
+	temperature = block[:, 2]
+	rel_hum = block[:, 3]
+	height = block[:, 4]
 
 	return (time, air_pressure, temperature, rel_hum, height)
 
@@ -65,254 +100,151 @@ def to_kelvin(c):
 def to_celsius(k):
 	return k - 273.16
 
-def parse_cabauw_data(data, metadata, basetime, latest_time):
-	data = data.split()
-	splitted = list(grouper(len(metadata), data))
-	time = np.array([])
-	wind_speed_10 = np.array([])
-	wind_speed_20 = np.array([])
-	wind_speed_40 = np.array([])
-	wind_speed_80 = np.array([])
-	wind_speed_140 = np.array([])
-	wind_speed_200 = np.array([])
-
-	wind_dir_10 = np.array([])
-	wind_dir_20 = np.array([])
-	wind_dir_40 = np.array([])
-	wind_dir_80 = np.array([])
-	wind_dir_140 = np.array([])
-	wind_dir_200 = np.array([])
-
-	air_temp_10 = np.array([])
-	air_temp_20 = np.array([])
-	air_temp_40 = np.array([])
-	air_temp_80 = np.array([])
-	air_temp_140 = np.array([])
-	air_temp_200 = np.array([])
-
-	dew_point_temp_10 = np.array([])
-	dew_point_temp_20 = np.array([])
-	dew_point_temp_40 = np.array([])
-	dew_point_temp_80 = np.array([])
-	dew_point_temp_140 = np.array([])
-	dew_point_temp_200 = np.array([])
-
-	relative_humidity_10 = np.array([])
-	relative_humidity_20 = np.array([])
-	relative_humidity_40 = np.array([])
-	relative_humidity_80 = np.array([])
-	relative_humidity_140 = np.array([])
-	relative_humidity_200 = np.array([])
-
-	visibility_10 = np.array([])
-	visibility_20 = np.array([])
-	visibility_40 = np.array([])
-	visibility_80 = np.array([])
-	visibility_140 = np.array([])
-	visibility_200 = np.array([])
-
-	air_pressure = np.array([])
-
-	for observation in splitted:
-		if any(obs == 'NAN' for obs in observation):
-			continue
-		secs_passed = int(observation[0])
-		mapped_time = basetime + timedelta(seconds=secs_passed)
-		if latest_time is None or mapped_time > latest_time:
-			time = np.append(time, mapped_time)
-			wind_speed_token = observation[1]
-			assert(wind_speed_token == 'ws')
-			wind_speed_10 = np.append(wind_speed_10, float(observation[2]))
-			wind_speed_20 = np.append(wind_speed_20, float(observation[3]))
-			wind_speed_40 = np.append(wind_speed_40, float(observation[4]))
-			wind_speed_80 = np.append(wind_speed_80, float(observation[5]))
-			wind_speed_140 = np.append(wind_speed_140, float(observation[6]))
-			wind_speed_200 = np.append(wind_speed_200, float(observation[7]))
-
-			wind_dir_token = observation[8]
-			assert(wind_dir_token == 'wr')
-			wind_dir_10 = np.append(wind_dir_10, float(observation[9]))
-			wind_dir_20 = np.append(wind_dir_20, float(observation[10]))
-			wind_dir_40 = np.append(wind_dir_40, float(observation[11]))
-			wind_dir_80 = np.append(wind_dir_80, float(observation[12]))
-			wind_dir_140 = np.append(wind_dir_140, float(observation[13]))
-			wind_dir_200 = np.append(wind_dir_200, float(observation[14]))
-
-			air_temp_token = observation[15]
-			assert(air_temp_token == 'ta')
-			air_temp_10 = np.append(air_temp_10, float(observation[16]))
-			air_temp_20 = np.append(air_temp_20, float(observation[17]))
-			air_temp_40 = np.append(air_temp_40, float(observation[18]))
-			air_temp_80 = np.append(air_temp_80, float(observation[19]))
-			air_temp_140 = np.append(air_temp_140, float(observation[20]))
-			air_temp_200 = np.append(air_temp_200, float(observation[21]))
-
-			dew_point_temp_token = observation[22]
-			assert(dew_point_temp_token == 'td')
-			dew_point_temp_10 = np.append(dew_point_temp_10, float(observation[23]))
-			dew_point_temp_20 = np.append(dew_point_temp_20, float(observation[24]))
-			dew_point_temp_40 = np.append(dew_point_temp_40, float(observation[25]))
-			dew_point_temp_80 = np.append(dew_point_temp_80, float(observation[26]))
-			dew_point_temp_140 = np.append(dew_point_temp_140, float(observation[27]))
-			dew_point_temp_200 = np.append(dew_point_temp_200, float(observation[28]))
-
-			relative_humidity_token = observation[29]
-			assert(relative_humidity_token == 'rh')
-			relative_humidity_10 = np.append(relative_humidity_10, int(observation[30]))
-			relative_humidity_20 = np.append(relative_humidity_20, int(observation[31]))
-			relative_humidity_40 = np.append(relative_humidity_40, int(observation[32]))
-			relative_humidity_80 = np.append(relative_humidity_80, int(observation[33]))
-			relative_humidity_140 = np.append(relative_humidity_140, int(observation[34]))
-			relative_humidity_200 = np.append(relative_humidity_200, int(observation[35]))
-
-			visibility_token = observation[36]
-			assert(visibility_token == 'zm')
-			visibility_10 = np.append(visibility_10, float(observation[37]))
-			visibility_20 = np.append(visibility_20, float(observation[38]))
-			visibility_40 = np.append(visibility_40, float(observation[39]))
-			visibility_80 = np.append(visibility_80, float(observation[40]))
-			visibility_140 = np.append(visibility_140, float(observation[41]))
-			visibility_200 = np.append(visibility_200, float(observation[42]))
-
-			air_pressure_token = observation[43]
-			air_pressure = np.append(air_pressure, float(observation[44]))
-
-	potential_temp_10 = list(map(to_celsius, getTheta(list(map(to_kelvin, air_temp_10)), list(map(lambda x: x + correct_pressure(10), air_pressure)))))
-	potential_temp_20 = list(map(to_celsius, getTheta(list(map(to_kelvin, air_temp_20)), list(map(lambda x: x + correct_pressure(20), air_pressure)))))
-	potential_temp_40 = list(map(to_celsius, getTheta(list(map(to_kelvin, air_temp_40)), list(map(lambda x: x + correct_pressure(40), air_pressure)))))
-	potential_temp_80 = list(map(to_celsius, getTheta(list(map(to_kelvin, air_temp_80)), list(map(lambda x: x + correct_pressure(80), air_pressure)))))
-	potential_temp_140 = list(map(to_celsius, getTheta(list(map(to_kelvin, air_temp_140)), list(map(lambda x: x + correct_pressure(140), air_pressure)))))
-	potential_temp_200 = list(map(to_celsius, getTheta(list(map(to_kelvin, air_temp_200)), list(map(lambda x: x + correct_pressure(200), air_pressure)))))
-
-	potential_dewpoint_temp_10 = list(map(to_celsius, getTheta(list(map(to_kelvin, dew_point_temp_10)), list(map(lambda x: x + correct_pressure(10), air_pressure)))))
-	potential_dewpoint_temp_20 = list(map(to_celsius, getTheta(list(map(to_kelvin, dew_point_temp_20)), list(map(lambda x: x + correct_pressure(20), air_pressure)))))
-	potential_dewpoint_temp_40 = list(map(to_celsius, getTheta(list(map(to_kelvin, dew_point_temp_40)), list(map(lambda x: x + correct_pressure(40), air_pressure)))))
-	potential_dewpoint_temp_80 = list(map(to_celsius, getTheta(list(map(to_kelvin, dew_point_temp_80)), list(map(lambda x: x + correct_pressure(80), air_pressure)))))
-	potential_dewpoint_temp_140 = list(map(to_celsius, getTheta(list(map(to_kelvin, dew_point_temp_140)), list(map(lambda x: x + correct_pressure(140), air_pressure)))))
-	potential_dewpoint_temp_200 = list(map(to_celsius, getTheta(list(map(to_kelvin, dew_point_temp_200)), list(map(lambda x: x + correct_pressure(200), air_pressure)))))
-
-	# print observation
-	wind_speed = {
-		10: wind_speed_10,
-		20: wind_speed_20,
-		40: wind_speed_40,
-		80: wind_speed_80,
-		140: wind_speed_140,
-		200: wind_speed_200
-	}
-	wind_dir = {
-		10: wind_dir_10,
-		20: wind_dir_20,
-		40: wind_dir_40,
-		80: wind_dir_80,
-		140: wind_dir_140,
-		200: wind_dir_200
-	}
-	air_temp = {
-		10: air_temp_10,
-		20: air_temp_20,
-		40: air_temp_40,
-		80: air_temp_80,
-		140: air_temp_140,
-		200: air_temp_200
-	}
-
-	pot_temps_c = {
-		10: potential_temp_10,
-		20: potential_temp_20,
-		40: potential_temp_40,
-		80: potential_temp_80,
-		140: potential_temp_140,
-		200: potential_temp_200
-	}
-	pot_dewpoint_temps_c = {
-		10: potential_dewpoint_temp_10,
-		20: potential_dewpoint_temp_20,
-		40: potential_dewpoint_temp_40,
-		80: potential_dewpoint_temp_80,
-		140: potential_dewpoint_temp_140,
-		200: potential_dewpoint_temp_200
-	}
-	dew_point_temp = {
-		10: dew_point_temp_10,
-		20: dew_point_temp_20,
-		40: dew_point_temp_40,
-		80: dew_point_temp_80,
-		140: dew_point_temp_140,
-		200: dew_point_temp_200
-	}
-	relative_humidity = {
-		10: relative_humidity_10,
-		20: relative_humidity_20,
-		40: relative_humidity_40,
-		80: relative_humidity_80,
-		140: relative_humidity_140,
-		200: relative_humidity_200
-	}
-	visibility = {
-		10: visibility_10,
-		20: visibility_20,
-		40: visibility_40,
-		80: visibility_80,
-		140: visibility_140,
-		200: visibility_200
-	}
-
+def cabauw_layout(metadata):
+	# group the metadata columns per variable: a token column (marked with "variable")
+	# followed by the values of that variable at the tower levels.
+	# returns [(variable, token column index, expected token, [value column indices])]
+	layout = []
+	for (i, column) in enumerate(metadata):
+		if 'variable' in column:
+			layout.append((column['variable'], i, column.get('token'), []))
+		elif layout:
+			layout[-1][3].append(i)
+	return layout
+
+def cabauw_levels(metadata):
+	# tower heights in meters, taken from the "... at 10m" column names of the first variable
+	(variable, token_idx, token, columns) = cabauw_layout(metadata)[0]
+	return [int(re.search(r'at (\d+)m', metadata[i]['name']).group(1)) for i in columns]
+
+def cabauw_rows(data, metadata):
+	# read the token layout into a float block of the time column followed by the value
+	# columns of every variable, without the rows that have a NAN
+	layout = cabauw_layout(metadata)
+	ncols = len(metadata)
+	tokens = np.array(data.split(), dtype=str)
+	nrows = len(tokens) // ncols
+	block = tokens[:nrows * ncols].reshape(nrows, ncols)
+	block = block[~(block == 'NAN').any(axis=1)]
+
+	for (variable, token_idx, token, columns) in layout:
+		if token is not None and not (block[:, token_idx] == token).all():
+			raise ValueError('Unexpected token in Cabauw column {0}, expected {1!r}'.format(token_idx, token))
+
+	value_columns = [i for (variable, token_idx, token, columns) in layout for i in columns]
+	return block[:, [0] + value_columns].astype(float)
+
+def cabauw_columns(data, metadata, basetime, latest_time):
+	# the time and a (time x levels) array per variable
+	layout = cabauw_layout(metadata)
+	rows = data.block() if isinstance(data, ChunkParser) else cabauw_rows(data, metadata)
+	secs = rows[:, 0].astype(np.int64)
+	values = rows[:, 1:]
+	if latest_time is not None:
+		newer = secs > seconds_since(latest_time, basetime)
+		values = values[newer]
+		secs = secs[newer]
+
+	variables = {}
+	offset = 0
+	for (variable, token_idx, token, columns) in layout:
+		variables[variable] = values[:, offset:offset + len(columns)]
+		offset += len(columns)
+
+	return to_datetime64(secs, basetime), variables
 
-	mixing_ratios = {}
-	for h in [10, 20, 40, 80, 140, 200]:
-		kelvin_dew_point_temp = map(to_kelvin, dew_point_temp[h])
-		qs = get_mixing_ratio(map(lambda x: x + correct_pressure(h), air_pressure), kelvin_dew_point_temp)
-		mixing_ratios[h] = np.multiply(1000.0, qs)
+def parse_cabauw_data(data, metadata, basetime, latest_time):
+	with instrument.stage('parse_cabauw'):
+		time, variables = cabauw_columns(data, metadata, basetime, latest_time)
+	instrument.count('cabauw_rows_parsed', len(time))
+	levels = cabauw_levels(metadata)
+
+	wind_speed = variables['wind_speeds']
+	wind_dir = variables['wind_directions']
+	air_temp = variables['air_temperatures']
+	dew_point_temp = variables['dew_point_temperatures']
+	relative_humidity = variables['relative_humidities']
+	visibility = variables['visibilities']
+	air_pressure = variables['air_pressure'][:, 0]
+
+	with instrument.stage('thermo_cabauw'):
+		# (time x level) pressures: the surface pressure corrected for every tower height
+		level_pressure = air_pressure[:, np.newaxis] + correct_pressure(np.asarray(levels, dtype=float))
+		log_p = np.log(np.divide(1000.0, level_pressure))
+		dew_point_k = to_kelvin(dew_point_temp)
+		# back to celsius in place
+		pot_temps_c = theta_at(to_kelvin(air_temp), log_p)
+		pot_temps_c -= 273.16
+		pot_dewpoint_temps_c = theta_at(dew_point_k, log_p)
+		pot_dewpoint_temps_c -= 273.16
+		mixing_ratios = get_mixing_ratio(level_pressure, dew_point_k)
+		mixing_ratios *= 1000.0
 
 	return time, wind_speed, wind_dir, air_temp, pot_temps_c, dew_point_temp, pot_dewpoint_temps_c, relative_humidity, visibility, mixing_ratios, air_pressure
 
-def compute_dewpoint_temp(qt, pres):
-	e=qt*pres/(.622+qt)
-	f=np.log(e/6.11)/17.269
-	result=(273.16-f*35.86)/(1.-f)
-	return result
-
-def process_drone_data(data, basetime, metadata, current_air_pressure, latest_time):
-	time, air_pressure, temperature, rel_hum, height = parse_radio_data(data, metadata, basetime, latest_time)
-	if len(air_pressure) == 0 or len(temperature) == 0 or len(rel_hum) == 0:
-		return {
-			'time': [],
-			'air_pressure': [],
-			'temperature': [],
-			'dew_point_temp': [],
-			'potential_dewpoint_temp': [],
-			'relative_humidity': [],
-			'height': [],
-			'potential_temperature': [],
-			'computed_height': [],
-			'qs': [],
-			'q': []
+class DroneProcessor(object):
+	# processes the drone data batch by batch. the height integration continues
+	# from the last sample of the previous batch, so every call only works on the new samples.
+	def __init__(self, metadata):
+		self.metadata = metadata
+		self.reset()
+
+	def reset(self):
+		# start a new profile at 0 m with the next batch
+		self.previous = None
+
+	def process(self, data, basetime, current_air_pressure, latest_time):
+		with instrument.stage('parse_radio'):
+			time, air_pressure, temperature, rel_hum, height = parse_radio_data(data, self.metadata, basetime, latest_time)
+		instrument.count('drone_rows_parsed', len(time))
+		if len(air_pressure) == 0 or len(temperature) == 0 or len(rel_hum) == 0:
+			return {
+				'time': [],
+				'air_pressure': [],
+				'temperature': [],
+				'dew_point_temp': [],
+				'potential_dewpoint_temp': [],
+				'relative_humidity': [],
+				'height': [],
+				'potential_temperature': [],
+				'computed_height': [],
+				'qs': [],
+				'q': []
+			}
+
+
+		with instrument.stage('thermo_drone'):
+			(computed_height, potential_temperature, qs, q, virtual_potential_temperature, computed_dew_temp, potential_dewpoint_temperature) = calculate_height(air_pressure, temperature, rel_hum, current_air_pressure, self.previous)
+			if self.previous is None:
+				start_pressure = current_air_pressure
+			else:
+				start_pressure = self.previous[2]
+			if len(air_pressure) > 1:
+				start_pressure = air_pressure[-2]
+			self.previous = (computed_height[-1], start_pressure, air_pressure[-1], virtual_potential_temperature[-1])
+
+			potential_temperature = potential_temperature - 273.15
+			computed_dew_temp = computed_dew_temp - 273.15
+			potential_dewpoint_temperature = potential_dewpoint_temperature - 273.15
+
+		radio_data = {
+			'time': time,
+			'air_pressure': air_pressure,
+			'temperature': temperature,
+			'dew_point_temp': computed_dew_temp,
+			'potential_dewpoint_temp': potential_dewpoint_temperature,
+			'relative_humidity': rel_hum,
+			'height': height,
+			'potential_temperature': potential_temperature,
+			'computed_height': computed_height,
+			'qs': qs,
+			'q': np.multiply(1000.0, q)
 		}
+		return radio_data
 
-
-	(computed_height, potential_temperature, qs, q) = calculate_height(air_pressure, temperature, rel_hum, current_air_pressure)
-	potential_temperature = list(map(lambda x: x - 273.15, potential_temperature))
-	computed_dew_temp = compute_dewpoint_temp(q, air_pressure)
-	potential_dewpoint_temperature = getTheta(computed_dew_temp, air_pressure)
-
-	computed_dew_temp = list(map(lambda x: x - 273.15, computed_dew_temp))
-	potential_dewpoint_temperature = list(map(lambda x: x - 273.15, potential_dewpoint_temperature))
-
-	radio_data = {
-		'time': time,
-		'air_pressure': air_pressure,
-		'temperature': temperature,
-		'dew_point_temp': computed_dew_temp,
-		'potential_dewpoint_temp': potential_dewpoint_temperature,
-		'relative_humidity': rel_hum,
-		'height': height,
-		'potential_temperature': potential_temperature,
-		'computed_height': computed_height,
-		'qs': qs,
-		'q': np.multiply(1000.0, q)
-	}
-	return radio_data
+def process_drone_data(data, basetime, metadata, current_air_pressure, latest_time):
+	# process data as one profile starting at 0 m
+	return DroneProcessor(metadata).process(data, basetime, current_air_pressure, latest_time)
 	
 
 def process_cabauw_data(data_cabauw, basetime, metadata_cabauw, latest_time):
@@ -0,0 +1,80 @@
+import numpy as np
+
+
+class MinMaxDecimator(object):
+    # reduces a growing time series to what a line on max_buckets pixel columns can show.
+    # the samples are grouped in buckets of bucket_size (a power of two) and every bucket
+    # contributes its minimum and maximum in time order, so no peak disappears.
+    # the buckets of earlier calls are kept: a call only reduces the samples that were
+    # appended since, and when there are more than max_buckets buckets neighbouring
+    # buckets are merged, doubling the bucket size.
+    def __init__(self, max_buckets=1000):
+        self.max_buckets = max_buckets
+        self.reset()
+
+    def reset(self):
+        self.bucket_size = 1
+        self.mins = np.empty(0, dtype=np.intp)
+        self.maxs = np.empty(0, dtype=np.intp)
+        # number of samples covered by complete buckets
+        self.done = 0
+        self.first = None
+
+    def set_max_buckets(self, max_buckets):
+        # e.g. after the axes were resized
+        if max_buckets != self.max_buckets:
+            self.max_buckets = max_buckets
+            self.reset()
+
+    def _reduce(self, y, stop):
+        # append the min and max index of each complete bucket in y[self.done:stop]
+        block = y[self.done:stop].reshape(-1, self.bucket_size)
+        offsets = self.done + np.arange(len(block)) * self.bucket_size
+        self.mins = np.concatenate((self.mins, offsets + np.argmin(block, axis=1)))
+        self.maxs = np.concatenate((self.maxs, offsets + np.argmax(block, axis=1)))
+        self.done = stop
+
+    def _merge(self, y):
+        # double the bucket size by merging pairs of neighbouring buckets
+        if len(self.mins) % 2:
+            # the odd bucket out is reduced again with the tail
+            self.mins = self.mins[:-1]
+            self.maxs = self.maxs[:-1]
+            self.done -= self.bucket_size
+        lo = self.mins.reshape(-1, 2)
+        hi = self.maxs.reshape(-1, 2)
+        self.mins = np.where(y[lo[:, 0]] <= y[lo[:, 1]], lo[:, 0], lo[:, 1])
+        self.maxs = np.where(y[hi[:, 0]] >= y[hi[:, 1]], hi[:, 0], hi[:, 1])
+        self.bucket_size *= 2
+
+    def indices(self, x, y):
+        # indices of the samples to draw, in time order
+        n = len(y)
+        first = x[0] if n > 0 else None
+        if n < self.done or first != self.first:
+            # the series was replaced or its start moved
+            self.reset()
+            self.first = first
+
+        if self.bucket_size == 1:
+            if n <= 2 * self.max_buckets:
+                return np.arange(n)
+            self.bucket_size = 2 ** int(np.ceil(np.log2(float(n) / self.max_buckets)))
+
+        while True:
+            stop = self.done + (n - self.done) // self.bucket_size * self.bucket_size
+            if stop > self.done:
+                self._reduce(y, stop)
+            if len(self.mins) <= self.max_buckets:
+                break
+            self._merge(y)
+
+        idx = np.sort(np.column_stack((self.mins, self.maxs)), axis=1).ravel()
+        if self.done < n:
+            tail = y[self.done:]
+            idx = np.concatenate((idx, self.done + np.unique([np.argmin(tail), np.argmax(tail)])))
+        return idx
+
+    def __call__(self, x, y):
+        idx = self.indices(x, y)
+        return (x[idx], y[idx])
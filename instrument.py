@@ -0,0 +1,143 @@
+# timers and counters for the stages of a poll or a refresh.
+#
+#   with instrument.record('refresh'):
+#       with instrument.stage('draw'):
+#           ...
+#       instrument.count('artists_redrawn', 13)
+#
+# the stages and counts of a record are kept per thread, the last finished record
+# of each name is in last and is appended as a json line to the log when one is set.
+# nothing is measured until enable() is called.
+import json
+import threading
+import time
+
+enabled = False
+log_file = None
+last = {}
+_log_lock = threading.Lock()
+_current = threading.local()
+
+
+class _Null(object):
+    # the timer and record when disabled
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL = _Null()
+
+class Record(object):
+    def __init__(self, name):
+        self.name = name
+        self.started = None
+        self.seconds = None
+        # stage names in the order they first ran, and stage name -> seconds
+        self.stages = []
+        self.timings = {}
+        self.counts = {}
+        # stages can run on helper threads, see within
+        self.lock = threading.Lock()
+
+    def add_time(self, stage, seconds):
+        with self.lock:
+            if stage not in self.timings:
+                self.stages.append(stage)
+                self.timings[stage] = 0.0
+            self.timings[stage] += seconds
+
+    def add_count(self, counter, n):
+        with self.lock:
+            self.counts[counter] = self.counts.get(counter, 0) + n
+
+    def __enter__(self):
+        self.parent = getattr(_current, 'record', None)
+        _current.record = self
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.time() - self.started
+        _current.record = self.parent
+        last[self.name] = self
+        if log_file is not None:
+            line = json.dumps({'record': self.name, 'started': self.started, 'seconds': self.seconds,
+                'stages': self.timings, 'counts': self.counts})
+            with _log_lock:
+                log_file.write(line + '\n')
+                log_file.flush()
+        return False
+
+    def summary(self):
+        stages = ' '.join('{0} {1:.0f}'.format(s, 1000 * self.timings[s]) for s in self.stages)
+        counts = ' '.join('{0} {1}'.format(c, self.counts[c]) for c in sorted(self.counts))
+        return '{0} {1:.0f} ms ({2}) {3}'.format(self.name, 1000 * self.seconds, stages, counts).strip()
+
+class Within(object):
+    # makes record the current record of another thread for a block
+    def __init__(self, record):
+        self.record = record
+
+    def __enter__(self):
+        self.parent = getattr(_current, 'record', None)
+        _current.record = self.record
+        return self.record
+
+    def __exit__(self, *exc_info):
+        _current.record = self.parent
+        return False
+
+class Stage(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        record = getattr(_current, 'record', None)
+        if record is not None:
+            record.add_time(self.name, time.time() - self.started)
+        return False
+
+
+def enable(log_path=None):
+    global enabled, log_file
+    if log_path is not None:
+        log_file = open(log_path, 'a')
+    enabled = True
+
+def disable():
+    global enabled, log_file
+    enabled = False
+    if log_file is not None:
+        log_file.close()
+        log_file = None
+
+def record(name):
+    # collects the stages and counts of one poll or refresh on this thread
+    return Record(name) if enabled else _NULL
+
+def stage(name):
+    # times the block into the current record
+    return Stage(name) if enabled else _NULL
+
+def current():
+    # the record of this thread, to pass to within on a helper thread
+    return getattr(_current, 'record', None)
+
+def within(record):
+    return Within(record) if enabled and record is not None else _NULL
+
+def count(counter, n=1):
+    if enabled:
+        record = getattr(_current, 'record', None)
+        if record is not None:
+            record.add_count(counter, n)
+
+def summary(names=('poll', 'refresh')):
+    # one line for the status bar
+    return ' | '.join(last[name].summary() for name in names if name in last)
@@ -1,8 +1,11 @@
 import numpy as np
 
+Rd = 287.04
+
 # Meteo stuff
 def get_mixing_ratio(pressure, temperature):
-	return np.divide(np.multiply(0.622, es(temperature)), np.subtract(pressure, es(temperature)))
+	e = es(temperature)
+	return np.divide(np.multiply(0.622, e), np.subtract(pressure, e))
 
 def get_true_mixing_ratio(rel_hum_frac, pressure, temp):
 	return rel_hum_frac * get_mixing_ratio(pressure, temp)
@@ -18,10 +21,39 @@ def cpd(temperature):
 	return 1005 + np.divide(np.subtract(temperature, 250) ** 2,  3364.0)
 
 def getTheta(temperature, pressure):
-	Rd = 287.04
 	chi = np.divide(Rd, cpd(temperature))
 	return np.multiply(temperature, np.power(np.divide(1000.0, pressure), chi))
 
+def theta_at(temperature, log_p, out=None):
+	# getTheta with log_p = ln(1000 / pressure) given, for several temperatures at one pressure
+	return np.multiply(temperature, np.exp(np.divide(Rd, cpd(temperature)) * log_p), out=out)
+
+def dewpoint(q, pressure, out=None):
+	# the temperature (K) at which es equals the vapour pressure of mixing ratio q
+	f = np.log(q * pressure / (0.622 + q) / 6.11) / 17.269
+	return np.divide(273.16 - f * 35.86, 1.0 - f, out=out)
+
+def thermodynamics(air_pressure, temperature, rel_hum_frac, out=None):
+	# es, qs, q, Tv, theta, theta_v, Td and theta_d of temperature (K) at air_pressure (hPa)
+	# and relative humidity (0-1), in one pass: es and ln(1000 / p) are computed once.
+	# out is a tuple of 8 arrays to write the results to, as with numpy ufuncs
+	air_pressure = np.asarray(air_pressure, dtype=float)
+	temperature = np.asarray(temperature, dtype=float)
+	if out is None:
+		shape = np.broadcast(air_pressure, temperature, rel_hum_frac).shape
+		out = tuple(np.empty(shape) for i in range(8))
+	(e_s, q_s, q, t_v, theta, theta_v, t_d, theta_d) = out
+	np.multiply(6.11, np.exp(17.269 * (temperature - 273.16) / (temperature - 35.86)), out=e_s)
+	np.divide(0.622 * e_s, air_pressure - e_s, out=q_s)
+	np.multiply(rel_hum_frac, q_s, out=q)
+	np.multiply(1.0 + 0.609 * q, temperature, out=t_v)
+	log_p = np.log(np.divide(1000.0, air_pressure))
+	theta_at(temperature, log_p, out=theta)
+	theta_at(t_v, log_p, out=theta_v)
+	dewpoint(q, air_pressure, out=t_d)
+	theta_at(t_d, log_p, out=theta_d)
+	return out
+
 def get_height(z1, theta1, p1, theta2, p2):
 	# ; inputs
 	# ; 1) z1 ; height of level 1 (m)
@@ -31,6 +63,12 @@ def get_height(z1, theta1, p1, theta2, p2):
 	# ; 5) p2: pressure at level 2 (hPa)
 	# ; outputs
 	# ; 1) height: the height of level 2 (m)
+	return z1 + get_layer_thickness(theta1, p1, theta2, p2)
+
+def get_layer_thickness(theta1, p1, theta2, p2):
+	# height difference z2 - z1 between level 1 and 2 (m), elementwise for arrays.
+	# the layer mean temperature (T2 - T1) / ln(T2 / T1) is undefined for equal
+	# temperatures, it is T1 then (same special case as thv1 == thv2 in calculate_pressure)
 	r = 287.0
 	g = 9.8
 	p21 = np.divide(p2, p1)
@@ -39,9 +77,10 @@ def get_height(z1, theta1, p1, theta2, p2):
 	p11000 = np.divide(p1, 1000.0)
 	part1 = np.multiply(theta2, np.power(p21000, 0.286))
 	part2 = np.multiply(theta1, np.power(p11000, 0.286))
-	part3 = np.multiply(t21, np.power(p21, 0.286))
-	result = z1 - (r/g)*(np.subtract(part1, part2))*np.log(p21)/np.log(part3)
-	return result
+	log_part3 = np.log(np.multiply(t21, np.power(p21, 0.286)))
+	equal = log_part3 == 0
+	result = -(r/g)*(np.subtract(part1, part2))*np.log(p21)/np.where(equal, 1.0, log_part3)
+	return np.where(equal, -(r/g)*part2*np.log(p21), result)
 
 def calculate_pressure(pressu,p1,thv1,z1,thv2,z2):
 	g = 9.8
@@ -52,22 +91,32 @@ def calculate_pressure(pressu,p1,thv1,z1,thv2,z2):
 		RESULT = (p1 ** .286 + 1000.0 ** .286 * (g/cp) * (z1-z2) * np.log(thv1/thv2) / (thv1-thv2)) ** (1.0/0.286)
 	return RESULT
 
-def calculate_height (air_pressure, temperature, rel_hum, initial_pressure): 
+def integrate_height(virtual_potential_temperature, air_pressure, initial_pressure, initial_height=0.0):
+	# height of every sample, starting at initial_height. the layer up to sample i + 1 is
+	# bounded by the pressures of samples i - 1 (initial_pressure for the first layer) and i,
+	# and the virtual potential temperatures of samples i and i + 1.
+	air_pressure = np.asarray(air_pressure, dtype=float)
+	if len(air_pressure) == 0:
+		return np.array([])
+	p1 = np.concatenate(([initial_pressure], air_pressure[:-1]))[:-1]
+	p2 = air_pressure[:-1]
+	# equal pressures would give a zero thickness over zero
+	p2 = np.where(p2 == p1, p2 + 1e-5, p2)
+	thickness = get_layer_thickness(virtual_potential_temperature[:-1], p1, virtual_potential_temperature[1:], p2)
+	return np.cumsum(np.concatenate(([initial_height], thickness)))
+
+def calculate_height (air_pressure, temperature, rel_hum, initial_pressure, previous=None): 
+	# previous: (height, start pressure, pressure, virtual potential temperature) of the
+	# sample before air_pressure[0], to continue a profile instead of starting at 0 m.
+	# returns (heights, theta, qs, q, theta_v, Td, theta_d), temperatures in K
 	# perform conversions for functions
-	kelvin_temp = list(map(lambda x: x + 273.15, temperature))
-	rel_hum_frac = rel_hum * 0.01
-
-	qs = get_mixing_ratio(air_pressure, kelvin_temp)
-	q = rel_hum_frac * qs
-	virt_temp = virtual_temperature(kelvin_temp, rel_hum_frac, air_pressure)
-	virtual_potential_temperature = getTheta(virt_temp, air_pressure)
-	potential_temperature = getTheta(kelvin_temp, air_pressure)
-	start_pressure = initial_pressure
-	start_height = 0
-	heights = [0]
-	for i in range(len(potential_temperature) - 1):
-		h = get_height(start_height, virtual_potential_temperature[i], start_pressure, virtual_potential_temperature[i + 1], air_pressure[i] + (1e-5 if air_pressure[i] == start_pressure else 0))
-		heights.append(h)
-		start_height = heights[-1]
-		start_pressure = air_pressure[i]
-	return (heights, potential_temperature, qs, q)
+	kelvin_temp = np.add(temperature, 273.15)
+	rel_hum_frac = np.multiply(rel_hum, 0.01)
+
+	(e_s, qs, q, virt_temp, potential_temperature, virtual_potential_temperature, dewpoint_temperature, potential_dewpoint_temperature) = thermodynamics(air_pressure, kelvin_temp, rel_hum_frac)
+	if previous is None:
+		heights = integrate_height(virtual_potential_temperature, air_pressure, initial_pressure)
+	else:
+		(height, start_pressure, pressure, thv) = previous
+		heights = integrate_height(np.concatenate(([thv], virtual_potential_temperature)), np.concatenate(([pressure], air_pressure)), start_pressure, height)[1:]
+	return (heights, potential_temperature, qs, q, virtual_potential_temperature, dewpoint_temperature, potential_dewpoint_temperature)
@@ -0,0 +1,499 @@
+import os
+from collections import OrderedDict
+from datetime import datetime
+import matplotlib.dates as md
+from matplotlib.artist import setp
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+from matplotlib.transforms import Bbox
+import numpy as np
+import instrument
+from decimate import MinMaxDecimator
+from segment import FlightSegmenter
+
+
+LEVEL_COLORS = ['black', 'orange', 'cyan', 'blue', 'green', 'red']
+DRONE_STYLES = ['-', '--', ':', '-.']
+# extra room on a time axis when it has to grow, in days
+TIME_HEADROOM = 10 / (24 * 60.0)
+
+
+def fit_bounds(bounds, lower, upper, headroom, refit=False):
+    # axis bounds that show [lower, upper]. the current bounds are kept while the data
+    # fits, so most refreshes leave the axes alone; a side that has to grow gets headroom extra.
+    if refit:
+        return (lower, upper)
+    (current_lower, current_upper) = bounds
+    if current_lower <= lower and upper <= current_upper:
+        return tuple(bounds)
+    return (lower - headroom if lower < current_lower else current_lower,
+            upper + headroom if upper > current_upper else current_upper)
+
+def intersect(a, b):
+    # the rows in both slices, an empty slice at the later start when there are none
+    start = max(a.start, b.start)
+    return slice(start, max(start, min(a.stop, b.stop)))
+
+def date_num(time):
+    # datetime64 times -> matplotlib date numbers, at the last moment before they are drawn
+    return md.date2num(time) if len(time) > 0 else np.empty(0)
+
+def autosave_path(overwrite, directory='autosave'):
+    stamp = '%Y%m%d' if overwrite else '%Y%m%d-%H%M%S'
+    return os.path.join(directory, '{0}.png'.format(datetime.utcnow().strftime(stamp)))
+
+class DronePlot(object):
+ # the six panel figure, without any GUI. data is the (dict of drone name -> column store,
+ # cabauw column store) pair, levels the Cabauw tower heights. the drones are overlaid,
+ # each in a line style of its own, or only the selected ones are shown (see select).
+    def __init__(self, data, levels, dpi=100, figsize=(3.0, 3.0)):
+        self.data = data
+        self.levels = levels
+        self.dpi = dpi
+        self.num_plots = 6
+        self.axes = [None] * self.num_plots
+        self.plots_per_subplot = [None] * self.num_plots
+        # drone name -> its FlightSegmenter, the current flight is drawn over the previous one
+        self.flights = dict((name, FlightSegmenter()) for name in data[0])
+        # names of the drones to show, all of them when None
+        self.shown = None
+        # drone name -> its lines, see add_drone_lines
+        self.drone_lines = OrderedDict()
+        self.backgrounds = None
+        self.saving = False
+        # MinMaxDecimator per time series line
+        self.decimators = {}
+        # seconds back from the newest sample that are shown, the whole day when None (see set_window)
+        self.window_s = None
+        self.refit_pending = False
+        self.init_plot(figsize)
+
+    def plot_drone_data(self, xdata, ydata, axis_idx, color, alpha=1, symbol='-'):
+        self.plots_per_subplot[axis_idx] = 1 if self.plots_per_subplot[axis_idx] is None else self.plots_per_subplot[axis_idx] + 1
+        return self.axes[axis_idx].plot(xdata, ydata, symbol, linewidth=1, color=color, alpha=alpha)[0]
+
+    def plot_cabauw_data(self, xdata, ydata, axis_idx, alpha=1, symbol='-'):
+        # ydata is a (time x level) array, one line per tower level
+        self.plots_per_subplot[axis_idx] = 6 if self.plots_per_subplot[axis_idx] is None else self.plots_per_subplot[axis_idx] + 6
+        return [self.axes[axis_idx].plot(xdata, ydata[:, i], symbol, linewidth=1, color=c, alpha=alpha)[0] for (i, c) in enumerate(LEVEL_COLORS)]
+
+    def plot_cabauw_markers(self, cabauw_potential_temperatures, cabauw_potential_dewpoint_temperatures):
+        plots = []
+        for (i, c) in enumerate(LEVEL_COLORS):
+            plots.append(self.plot_drone_data(cabauw_potential_temperatures[-1, i], [self.levels[i]], 0, c, alpha=0.5, symbol='o'))
+        for (i, c) in enumerate(LEVEL_COLORS):
+            plots.append(self.plot_drone_data(cabauw_potential_dewpoint_temperatures[-1, i], [self.levels[i]], 0, c, alpha=0.5, symbol='^'))
+        # on top of the profiles of drones that are added later
+        for marker in plots:
+            marker.set_zorder(3)
+
+        return plots
+
+    def flight_slices(self, name):
+        # (previous flight, current flight) of a drone as slices of its column store,
+        # before the first takeoff all samples are the current flight
+        store = self.data[0][name]
+        flights = self.flights[name]
+        flights.update(store)
+        if not flights.flights:
+            return (slice(0, 0), slice(0, len(store)))
+        previous = flights.slice(flights.flights[-2], store) if len(flights.flights) > 1 else slice(0, 0)
+        return (previous, flights.slice(flights.flights[-1], store))
+
+    def add_drone_lines(self, name):
+        # the lines of one drone: the profiles of the previous flight faded under the current
+        # one, and the time series faded before the current flight
+        store = self.data[0][name]
+        (previous, current) = self.flight_slices(name)
+        idx = current.start
+        symbol = DRONE_STYLES[len(self.drone_lines) % len(DRONE_STYLES)]
+        time_drone = date_num(store['time'])
+        height_drone = store['computed_height']
+        lines = [
+            self.plot_drone_data(store['potential_temperature'][previous], height_drone[previous], 0, 'red', alpha=0.1, symbol=symbol),
+            self.plot_drone_data(store['potential_dewpoint_temp'][previous], height_drone[previous], 0, 'blue', alpha=0.1, symbol=symbol),
+            self.plot_drone_data(store['potential_temperature'][current], height_drone[current], 0, 'red', symbol=symbol),
+            self.plot_drone_data(store['potential_dewpoint_temp'][current], height_drone[current], 0, 'blue', symbol=symbol),
+
+            self.plot_drone_data(time_drone[:idx], store['temperature'][:idx], 1, 'blue', alpha=0.1, symbol=symbol),
+            self.plot_drone_data(time_drone[idx:], store['temperature'][idx:], 1, 'blue', symbol=symbol),
+
+            self.plot_drone_data(time_drone[:idx], store['q'][:idx], 2, 'blue', alpha=0.1, symbol=symbol),
+            self.plot_drone_data(time_drone[idx:], store['q'][idx:], 2, 'blue', symbol=symbol)
+        ]
+        for line in lines:
+            line.set_animated(True)
+        self.drone_lines[name] = lines
+        if len(self.data[0]) > 1:
+            self.axes[0].legend([l[2] for l in self.drone_lines.values()], list(self.drone_lines), loc='lower right', fontsize=8)
+
+    def select(self, names=None):
+        # show only the drones in names, all of them when None
+        self.shown = None if names is None else list(names)
+
+    def set_window(self, seconds=None):
+        # show only the last seconds, which the time axes follow; the whole day when None.
+        # a refresh then costs as much as the samples in the window, however long the day is
+        self.window_s = seconds
+        self.refit_pending = True
+
+    def window_start(self):
+        # time of the first sample in the window, None without a window
+        if self.window_s is None:
+            return None
+        latest = [store.last('time') for store in list(self.data[0].values()) + [self.data[1]] if len(store) > 0]
+        if not latest:
+            return None
+        return max(latest) - np.timedelta64(int(self.window_s), 's')
+
+    def window_rows(self, store):
+        # the rows of a column store in the window, a slice for views of its columns
+        return store.rows_between(self.window_start())
+
+    def init_plot(self, figsize):
+        self.fig = Figure(figsize, dpi=self.dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.set_title()
+        self.axes[0] = self.fig.add_subplot(231)
+        try:
+            self.axes[0].set_facecolor('white')
+        except AttributeError:
+            self.axes[0].set_axis_bgcolor('white')
+
+        self.axes[0].set_title('Drone - Potential temp/Height', size=12)
+        self.axes[0].set_xlabel('Potential Temperature (C)')
+        self.axes[0].set_ylabel('Height (m)')
+
+        self.axes[1] = self.fig.add_subplot(232)
+        try:
+            self.axes[1].set_facecolor('white')
+        except AttributeError:
+            self.axes[1].set_axis_bgcolor('white')
+
+        self.axes[1].set_title('Drone - Temperature drone', size=12)
+        self.axes[1].set_xlabel('Time (UTC)')
+        self.axes[1].set_ylabel('Temperature (C)')
+
+        self.axes[2] = self.fig.add_subplot(233)
+        try:
+            self.axes[2].set_facecolor('white')
+        except AttributeError:
+            self.axes[2].set_axis_bgcolor('white')
+
+        self.axes[2].set_title('Drone - Mixing ratio', size=12)
+        self.axes[2].set_xlabel('Time (UTC)')
+        self.axes[2].set_ylabel('Mixing ratio (g / kg)')
+
+        self.axes[3] = self.fig.add_subplot(234)
+        try:
+            self.axes[3].set_facecolor('white')
+        except AttributeError:
+            self.axes[3].set_axis_bgcolor('white')
+
+        self.axes[3].set_title('Cabauw - Potential temp/Height', size=12)
+        self.axes[3].set_xlabel('Time (UTC)')
+        self.axes[3].set_ylabel('Potential Temperature (C)')
+
+        self.axes[4] = self.fig.add_subplot(235)
+        try:
+            self.axes[4].set_facecolor('white')
+        except AttributeError:
+            self.axes[4].set_axis_bgcolor('white')
+
+        self.axes[4].set_title('Cabauw - Wind speed', size=12)
+        self.axes[4].set_xlabel('Time (UTC)')
+        self.axes[4].set_ylabel('Wind speed (m/s)')
+
+        self.axes[5] = self.fig.add_subplot(236)
+        try:
+            self.axes[5].set_facecolor('white')
+        except AttributeError:
+            self.axes[5].set_axis_bgcolor('white')
+
+        self.axes[5].set_title('Cabauw - Mixing Ratio', size=12)
+        self.axes[5].set_xlabel('Time (UTC)')
+        self.axes[5].set_ylabel('Mixing ratio (g / kg)')
+
+        for axis_idx in range(self.num_plots):
+            setp(self.axes[axis_idx].get_xticklabels(), fontsize=8)
+            setp(self.axes[axis_idx].get_yticklabels(), fontsize=8)
+
+        # plot the data as a line series, and save the reference 
+        # to the plotted line series
+        cabauw_time = self.data[1]['time']
+        cabauw_potential_temperatures = self.data[1]['potential_temperatures']
+        cabauw_potential_dewpoint_temperatures = self.data[1]['potential_dew_point_temperatures']
+        cabauw_wind_speeds = self.data[1]['wind_speeds']
+        cabauw_mixing_ratios = self.data[1]['mixing_ratios']
+        self.plot_data = [
+            self.plot_cabauw_markers(cabauw_potential_temperatures, cabauw_potential_dewpoint_temperatures),
+            
+            self.plot_cabauw_data(date_num(cabauw_time), cabauw_potential_temperatures, 3),
+            self.plot_cabauw_data(date_num(cabauw_time), cabauw_wind_speeds, 4),
+            self.plot_cabauw_data(date_num(cabauw_time), cabauw_mixing_ratios, 5),
+
+            self.plot_drone_data(date_num(cabauw_time), [8] * len(cabauw_time), 4, 'purple', symbol='--')
+        ]
+        for (name, store) in self.data[0].items():
+            if 'time' in store:
+                self.add_drone_lines(name)
+
+        xfmt = md.DateFormatter('%H:%M')
+        for ax in self.axes[1:]:
+            # the lines get date numbers, not datetimes, so the axes are told they show dates
+            ax.xaxis_date()
+            ax.xaxis.set_major_formatter(xfmt)
+
+        (lower, upper) = self.axes[4].get_ybound()
+        self.axes[4].set_ybound(lower, max(9, upper))
+
+        self.axes[4].legend(['  10m', '  20m', '  40m', '  80m', '140m', '200m'], loc='upper center', bbox_to_anchor=(0.5, -0.1), fancybox=True, ncol=6)
+
+        # the data lines and the title change on every refresh, they are drawn on top
+        # of the cached axes backgrounds (see blit)
+        for ax in self.axes:
+            for line in ax.lines:
+                line.set_animated(True)
+        self.fig._suptitle.set_animated(True)
+
+    def set_series(self, line, key, axes_idx, xdata, ydata):
+        # sets a time series on a line, reduced to the min/max per pixel column of the axes.
+        # returns the reduced y values, which still hold the extremes
+        if key not in self.decimators:
+            self.decimators[key] = MinMaxDecimator()
+        decimator = self.decimators[key]
+        decimator.set_max_buckets(max(1, int(self.axes[axes_idx].bbox.width)))
+        (xdata, ydata) = decimator(xdata, ydata)
+        line.set_xdata(date_num(xdata))
+        line.set_ydata(ydata)
+        return ydata
+
+    def update_cabauw_data(self, xdata, ydata, plot_idx, axes_idx, ydelta=0, refit=False, ymax_floor=None):
+        ymin = None
+        ymax = None
+        for i in range(len(LEVEL_COLORS)):
+            shown = self.set_series(self.plot_data[plot_idx][i], (plot_idx, i), axes_idx, xdata, ydata[:, i])
+            ymin = np.min(shown) if ymin is None else min(ymin, np.min(shown))
+            ymax = np.max(shown) if ymax is None else max(ymax, np.max(shown))
+
+        ymax = ymax + ydelta
+        if ymax_floor is not None:
+            ymax = max(ymax_floor, ymax)
+        return self.set_time_bounds(axes_idx, xdata, ymin - ydelta, ymax, refit)
+
+    def set_bounds(self, axes_idx, xlower, xupper, ylower, yupper, xheadroom, yheadroom, refit=False):
+        # returns whether the axis limits moved
+        ax = self.axes[axes_idx]
+        xbound = fit_bounds(ax.get_xbound(), xlower, xupper, xheadroom, refit)
+        ybound = fit_bounds(ax.get_ybound(), ylower, yupper, yheadroom, refit)
+        if xbound == tuple(ax.get_xbound()) and ybound == tuple(ax.get_ybound()):
+            return False
+        ax.set_xbound(*xbound)
+        ax.set_ybound(*ybound)
+        return True
+
+    def set_time_bounds(self, axes_idx, time, ylower, yupper, refit=False):
+        # time is sorted datetime64
+        xlower = md.date2num(time[0])
+        xupper = md.date2num(time[-1])
+        xheadroom = max(TIME_HEADROOM, 0.1 * (xupper - xlower))
+        if self.window_s is not None:
+            # a window slides on by the headroom when the data reaches its right edge, and
+            # the values that left it no longer count
+            (current_lower, current_upper) = self.axes[axes_idx].get_xbound()
+            if refit or xlower < current_lower or xupper > current_upper:
+                return self.set_bounds(axes_idx, xlower, xupper + xheadroom, ylower, yupper, 0, 0, refit=True)
+        return self.set_bounds(axes_idx, xlower, xupper, ylower, yupper, xheadroom, 0.1 * (yupper - ylower), refit)
+
+    def set_title(self):
+        parts = ['{0} - Cabauw Air pressure: {1:.1f} hPa'.format(datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'), self.data[1]['air_pressure'][-1])]
+        for (name, store) in self.data[0].items():
+            if len(store) > 0 and (self.shown is None or name in self.shown):
+                # the drones are named once there are several
+                parts.append('{0}GPS height: {1:.2f}m - Computed Height: {2:.2f}m'.format(name + ' ' if len(self.data[0]) > 1 else '',
+                    store['height'][-1], store['computed_height'][-1]))
+        self.fig.suptitle(' - '.join(parts))
+
+    def attach(self, canvas):
+        # show the figure on an interactive canvas, which is then updated by blitting
+        self.canvas = canvas
+        self.backgrounds = None
+        self.canvas.mpl_connect('draw_event', self.on_canvas_draw)
+
+    def on_canvas_draw(self, event):
+        # after a full redraw: cache the static parts, then draw the animated artists on top
+        if self.saving:
+            return
+        self.backgrounds = [self.canvas.copy_from_bbox(ax.bbox) for ax in self.axes]
+        title_extent = self.fig._suptitle.get_window_extent(event.renderer)
+        self.title_bbox = Bbox.from_extents(0, title_extent.y0 - 2, self.fig.bbox.width, title_extent.y1 + 2)
+        self.title_background = self.canvas.copy_from_bbox(self.title_bbox)
+        for ax in self.axes:
+            for line in sorted(ax.lines, key=Line2D.get_zorder):
+                ax.draw_artist(line)
+        self.fig.draw_artist(self.fig._suptitle)
+
+    def blit(self):
+        # redraw only the animated artists over the cached backgrounds
+        for (ax, background) in zip(self.axes, self.backgrounds):
+            self.canvas.restore_region(background)
+            for line in sorted(ax.lines, key=Line2D.get_zorder):
+                ax.draw_artist(line)
+            self.canvas.blit(ax.bbox)
+        self.canvas.restore_region(self.title_background)
+        self.fig.draw_artist(self.fig._suptitle)
+        self.canvas.blit(self.title_bbox)
+
+    def save_figure(self, path):
+        # figure level animated artists (the title) are skipped when saving
+        self.saving = True
+        self.fig._suptitle.set_animated(False)
+        try:
+            with instrument.stage('save'):
+                self.canvas.print_figure(path, dpi=self.dpi)
+        finally:
+            self.fig._suptitle.set_animated(True)
+            self.saving = False
+            # printing renders at its own size, take new backgrounds on the next refresh
+            self.backgrounds = None
+
+
+    def shown_drones(self):
+        return [name for name in self.drone_lines if self.shown is None or name in self.shown]
+
+    def update(self, refit=False):
+        # sets the new data on the artists and fits the axes, returns whether an axis moved
+        moved = False
+        refit = refit or self.refit_pending
+        self.refit_pending = False
+        refit_drones = refit
+        for (name, store) in self.data[0].items():
+            if name not in self.drone_lines and 'time' in store:
+                # a drone sent its first samples, the figure is drawn again with its lines.
+                # the drone axes only had default bounds before the first one
+                refit_drones = refit_drones or not self.drone_lines
+                self.add_drone_lines(name)
+                moved = True
+        shown_drones = self.shown_drones()
+
+        # views of the rows in the window, which keep at least the newest Cabauw row
+        window = self.window_rows(self.data[1])
+        rows = slice(min(window.start, len(self.data[1]) - 1), window.stop)
+        cabauw_time = self.data[1]['time'][rows]
+        cabauw_potential_temperatures = self.data[1]['potential_temperatures'][rows]
+        cabauw_potential_dewpoint_temperatures = self.data[1]['potential_dew_point_temperatures'][rows]
+        cabauw_wind_speeds = self.data[1]['wind_speeds'][rows]
+        cabauw_mixing_ratios = self.data[1]['mixing_ratios'][rows]
+
+        # first plot
+        profiles = []
+        heights = []
+        # the times, temperatures and mixing ratios shown in the second and third plot
+        times = []
+        temps = []
+        mixing_ratios = []
+        for (name, lines) in self.drone_lines.items():
+            for line in lines:
+                line.set_visible(name in shown_drones)
+            if name not in shown_drones:
+                continue
+            store = self.data[0][name]
+            (previous, current) = self.flight_slices(name)
+            window = self.window_rows(store)
+            if window.start == window.stop:
+                # nothing from this drone in the window
+                for line in lines:
+                    line.set_data([], [])
+                continue
+            previous = intersect(previous, window)
+            current = intersect(current, window)
+            idx = current.start
+            before = slice(window.start, idx)
+            after = slice(idx, window.stop)
+            time_drone = store['time']
+            height_drone = store['computed_height']
+            pot_temp_drone = store['potential_temperature']
+            pot_dewpoint_temp_drone = store['potential_dewpoint_temp']
+
+            lines[0].set_xdata(pot_temp_drone[previous])
+            lines[0].set_ydata(height_drone[previous])
+
+            lines[1].set_xdata(pot_dewpoint_temp_drone[previous])
+            lines[1].set_ydata(height_drone[previous])
+
+            lines[2].set_xdata(pot_temp_drone[current])
+            lines[2].set_ydata(height_drone[current])
+
+            lines[3].set_xdata(pot_dewpoint_temp_drone[current])
+            lines[3].set_ydata(height_drone[current])
+
+            profiles.extend([pot_temp_drone[current], pot_dewpoint_temp_drone[current]])
+            heights.append(height_drone[current])
+
+            temps.append(self.set_series(lines[4], (name, 4), 1, time_drone[before], store['temperature'][before]))
+            temps.append(self.set_series(lines[5], (name, 5), 1, time_drone[after], store['temperature'][after]))
+            mixing_ratios.append(self.set_series(lines[6], (name, 6), 2, time_drone[before], store['q'][before]))
+            mixing_ratios.append(self.set_series(lines[7], (name, 7), 2, time_drone[after], store['q'][after]))
+            times.append(time_drone[[window.start, window.stop - 1]])
+
+        xmin_cab = 1000
+        xmax_cab = -1000
+        for i in range(len(LEVEL_COLORS)):
+            self.plot_data[0][i].set_xdata(cabauw_potential_temperatures[-1, i])
+            self.plot_data[0][i + 6].set_xdata(cabauw_potential_dewpoint_temperatures[-1, i])
+            xmin_cab = min(cabauw_potential_dewpoint_temperatures[-1, i], xmin_cab)
+            xmin_cab = min(cabauw_potential_temperatures[-1, i], xmin_cab)
+            xmax_cab = max(cabauw_potential_dewpoint_temperatures[-1, i], xmax_cab)
+            xmax_cab = max(cabauw_potential_temperatures[-1, i], xmax_cab)
+
+        profiles = np.concatenate(profiles) if profiles else np.empty(0)
+        heights = np.concatenate(heights) if heights else np.empty(0)
+        xmin = np.min(profiles) if len(profiles) > 0 else 0
+        xmax = np.max(profiles) if len(profiles) > 0 else 0
+        ymax = max(210, np.max(heights) if len(heights) > 0 else 0)
+        ymin = np.min(heights) if len(heights) > 0 else 0
+        ydelta = 1
+        xdelta = 1
+        xlower = min(xmin_cab, xmin) - xdelta
+        xupper = max(xmax_cab, xmax) + xdelta
+        moved = self.set_bounds(0, xlower, xupper, ymin - ydelta, ymax + ydelta, 0.1 * (xupper - xlower), 0.1 * (ymax - ymin), refit_drones) or moved
+
+        if times:
+            times = np.concatenate(times)
+            time_drone = np.array([np.min(times), np.max(times)])
+
+            # second plot
+            shown = np.concatenate(temps)
+            moved = self.set_time_bounds(1, time_drone, np.min(shown) - ydelta, np.max(shown) + ydelta, refit_drones) or moved
+
+            # third plot
+            shown = np.concatenate(mixing_ratios)
+            ydelta = 0.5
+            moved = self.set_time_bounds(2, time_drone, np.min(shown) - ydelta, np.max(shown) + ydelta, refit_drones) or moved
+
+
+        # fourth plot
+        moved = self.update_cabauw_data(cabauw_time, cabauw_potential_temperatures, plot_idx=1, axes_idx=3, ydelta=1, refit=refit) or moved
+        # a straight line only needs its end points
+        self.plot_data[4].set_xdata(date_num(cabauw_time[[0, -1]]))
+        self.plot_data[4].set_ydata([8, 8])
+        # keep the 8 m/s line in view
+        moved = self.update_cabauw_data(cabauw_time, cabauw_wind_speeds, plot_idx=2, axes_idx=4, ydelta=1, refit=refit, ymax_floor=9) or moved
+        moved = self.update_cabauw_data(cabauw_time, cabauw_mixing_ratios, plot_idx=3, axes_idx=5, ydelta=0.5, refit=refit) or moved
+
+        return moved
+
+    def draw_plot(self, refit=False):
+        # # redraws the plot. only the lines are redrawn unless an axis had to move (or refit is set)
+        with instrument.stage('update'):
+            moved = self.update(refit)
+        if moved or self.backgrounds is None:
+            with instrument.stage('draw'):
+                self.canvas.draw()
+            if instrument.enabled:
+                instrument.count('artists_redrawn', len(self.fig.findobj()))
+        else:
+            with instrument.stage('blit'):
+                self.blit()
+            instrument.count('artists_redrawn', sum(len(ax.lines) for ax in self.axes) + 1)
@@ -5,72 +5,300 @@ import ftplib
 from pprint import pprint
 import StringIO
 import re 
-def poll_all(jsonconfig, pattern):
-    with open(jsonconfig) as jsonf:
-        ftpdata = json.loads(jsonf.read())
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+import instrument
 
-        ftp = ftplib.FTP( ftpdata['ftp']['server'] )
+KEEPALIVE_S = 60
+# sessions per config that poll_all transfers files with at the same time, the
+# "transfers" key of the config overrides it
+TRANSFERS = 3
+# errors after which a session is considered dropped and is reconnected
+DROPPED = (ftplib.error_temp, ftplib.error_reply, EOFError, IOError)
+_sessions = {}
+_sessions_lock = threading.Lock()
+_keepalive_thread = None
 
-        # login based on account given.
-        ftp.login(ftpdata['ftp']['user'] , ftpdata['ftp']['password'])
+class Session(object):
+    # an authenticated connection for one json config, kept open between polls
+    def __init__(self, jsonconfig):
+        with open(jsonconfig) as jsonf:
+            self.ftpdata = json.loads(jsonf.read())
+        self.ftp = None
+        self.last_used = 0
+        self.lock = threading.RLock()
 
-        ftp.cwd(ftpdata['ftp']['dir'])
+    def connect(self):
+        with self.lock:
+            self.close()
+            # the port is optional, e.g. for a local replay server (see benchmarks/replay.py)
+            ftp = ftplib.FTP()
+            ftp.connect(self.ftpdata['ftp']['server'], self.ftpdata['ftp'].get('port', 21))
 
-        files = ftp.nlst()
+            # login based on account given.
+            ftp.login(self.ftpdata['ftp']['user'] , self.ftpdata['ftp']['password'])
 
-        relevant_files = filter(lambda x: x.startswith(pattern), files)
+            ftp.cwd(self.ftpdata['ftp']['dir'])
+            self.ftp = ftp
+            self.last_used = time.time()
+            return ftp
 
-        sio = StringIO.StringIO()
+    def close(self):
+        with self.lock:
+            if self.ftp is not None:
+                try:
+                    self.ftp.quit()
+                except ftplib.all_errors:
+                    self.ftp.close()
+                self.ftp = None
 
+    def keepalive(self):
+        # NOOP an idle connection so the server keeps it, drop it if it is gone already
+        with self.lock:
+            if self.ftp is None or time.time() - self.last_used < KEEPALIVE_S:
+                return
+            try:
+                self.ftp.voidcmd('NOOP')
+                self.last_used = time.time()
+            except ftplib.all_errors:
+                self.close()
+
+    def get(self):
+        with self.lock:
+            self.keepalive()
+            return self.ftp if self.ftp is not None else self.connect()
+
+    def run(self, command):
+        # command(ftp), reconnecting once if the session was dropped
+        with self.lock:
+            try:
+                result = command(self.get())
+            except DROPPED:
+                result = command(self.connect())
+            self.last_used = time.time()
+            return result
+
+    def retrieve(self, filename, callback, rest=0, retries=2):
+        # RETR filename from byte rest; a dropped transfer is resumed after
+        # reconnecting, from the bytes already received
+        received = [0]
+        def handle_binary(more_data):
+            received[0] += len(more_data)
+            instrument.count('bytes_fetched', len(more_data))
+            callback(more_data)
+
+        with self.lock:
+            for attempt in range(retries + 1):
+                try:
+                    offset = rest + received[0]
+                    resp = self.get().retrbinary("RETR " + filename, callback=handle_binary, rest=offset or None)
+                    self.last_used = time.time()
+                    return resp
+                except DROPPED:
+                    self.close()
+                    if attempt == retries:
+                        raise
+
+def _keepalive_loop():
+    while True:
+        time.sleep(KEEPALIVE_S / 2.0)
+        with _sessions_lock:
+            sessions = list(_sessions.values())
+        for s in sessions:
+            # skip sessions that are busy transferring
+            if s.lock.acquire(False):
+                try:
+                    s.keepalive()
+                finally:
+                    s.lock.release()
+
+def session(jsonconfig, slot=0):
+    # the shared session for jsonconfig, created on first use. every slot is a
+    # connection of its own, for transfers that run at the same time
+    global _keepalive_thread
+    with _sessions_lock:
+        if (jsonconfig, slot) not in _sessions:
+            _sessions[(jsonconfig, slot)] = Session(jsonconfig)
+        if _keepalive_thread is None:
+            _keepalive_thread = threading.Thread(target=_keepalive_loop, name='ftp-keepalive')
+            _keepalive_thread.daemon = True
+            _keepalive_thread.start()
+        return _sessions[(jsonconfig, slot)]
+
+def close_all():
+    with _sessions_lock:
+        for s in _sessions.values():
+            s.close()
+        _sessions.clear()
+
+def remote_stat(ftp, filename):
+    # (size, modification time) of filename, None for what the server does not support
+    try:
+        ftp.voidcmd('TYPE I')
+        size = ftp.size(filename)
+    except ftplib.error_perm:
+        size = None
+    try:
+        mdtm = ftp.sendcmd('MDTM ' + filename)[4:].strip()
+    except ftplib.error_perm:
+        mdtm = None
+    return size, mdtm
+
+def poll_all(jsonconfig, pattern, manifest=None, write=None):
+    # without a manifest all files matching pattern are downloaded. with a manifest
+    # (a dict of filename -> FileTail kept by the caller) only the complete lines
+    # that were added since the previous call are returned, or passed to write(lines)
+    # chunk by chunk while they arrive when write is given.
+    ftp_session = session(jsonconfig)
+    files = ftp_session.run(lambda ftp: ftp.nlst())
+
+    relevant_files = filter(lambda x: x.startswith(pattern), files)
+
+    sio = StringIO.StringIO()
+
+    if manifest is None:
         # fetch all files matching the pattern
         for f in sorted(relevant_files):
-            ftp.retrbinary("RETR " + f, callback=lambda data: sio.write(data))
-
+            ftp_session.retrieve(f, sio.write)
         sio.seek(0)
-        ftp.quit()
         return sio
 
-def poll(jsonconfig, filename, bytes_received=0):
-    with open(jsonconfig) as jsonf:
-        ftpdata = json.loads(jsonf.read())
+    for f in list(manifest):
+        if f not in relevant_files:
+            del manifest[f]
 
-        ftp = ftplib.FTP( ftpdata['ftp']['server'] )
+    # the files are transferred on up to TRANSFERS sessions at the same time. every file
+    # collects its lines, they are written in file order when all transfers are done
+    files = sorted(relevant_files)
+    saved = dict((f, manifest[f].as_dict()) for f in files if f in manifest)
+    transfers = max(1, min(len(files), ftp_session.ftpdata['ftp'].get('transfers', TRANSFERS)))
+    record = instrument.current()
+    def poll_file(job):
+        with instrument.within(record):
+            return _poll_file(job)
+    def _poll_file(job):
+        (slot, f) = job
+        file_session = session(jsonconfig, slot)
+        state = manifest[f]
+        size, mdtm = file_session.run(lambda ftp: remote_stat(ftp, f))
+        if (size is not None and size < state.offset) or (mdtm != state.mdtm and size == state.offset):
+            # rewritten in place, fetch it again
+            state.reset(f)
+        elif size == state.offset and mdtm == state.mdtm:
+            return []
+        lines = []
+        # a single transfer can stream straight to write
+        _tail_into(file_session, f, state, write if (transfers == 1 and write is not None) else lines.append)
+        if size is not None and state.offset != size:
+            # it grew during the transfer, the modification time from before belongs to
+            # fewer bytes and would look like a rewrite on the next poll
+            mdtm = file_session.run(lambda ftp: remote_stat(ftp, f))[1]
+        state.mdtm = mdtm
+        return lines
 
-        # login based on account given.
-        ftp.login(ftpdata['ftp']['user'] , ftpdata['ftp']['password'])
+    for f in files:
+        manifest.setdefault(f, FileTail(f))
+    jobs = [(i % transfers, f) for (i, f) in enumerate(files)]
+    try:
+        if transfers == 1:
+            results = map(poll_file, jobs)
+        else:
+            pool = ThreadPool(transfers)
+            try:
+                results = pool.map(poll_file, jobs)
+            finally:
+                pool.close()
+    except:
+        # the lines of the files that did arrive are not returned either, read them again next time
+        for f in files:
+            manifest[f] = FileTail.from_dict(saved[f]) if f in saved else FileTail(f)
+        raise
 
-        ftp.cwd(ftpdata['ftp']['dir'])
+    for lines in results:
+        for l in lines:
+            (write or sio.write)(l)
+    sio.seek(0)
+    return sio
 
-        sio = StringIO.StringIO()
+def poll(jsonconfig, filename, bytes_received=0):
+    sio = StringIO.StringIO()
 
-        # open(filename, 'wb').write
-        # load ftp credentials (not public ask maarten or andrej) 
-        def handle_binary(more_data):
-            sio.write(more_data)
-        
-        if bytes_received != 0:
-            resp = ftp.retrbinary("RETR " + filename, callback=handle_binary, rest=bytes_received)
-        else:
-            resp = ftp.retrbinary("RETR " + filename, callback=handle_binary)
+    # load ftp credentials (not public ask maarten or andrej) 
+    session(jsonconfig).retrieve(filename, sio.write, bytes_received)
 
-        sio.seek(0) # Go back to the start
-        ftp.quit()
+    sio.seek(0) # Go back to the start
+    return sio
 
-        return sio
+class FileTail(object):
+    # how far a growing remote file has been read, its last seen modification
+    # time and the incomplete last line of the previous transfer
+    def __init__(self, filename=None):
+        self.reset(filename)
 
-def connect(ftpjson):
-    with open(ftpjson) as jsonf:
-        ftpdata = json.loads(jsonf.read())
-        pprint(ftpdata['ftp'])
+    def reset(self, filename=None):
+        self.filename = filename
+        self.offset = 0
+        self.mdtm = None
+        self.partial = ''
+
+    def as_dict(self):
+        return {'filename': self.filename, 'offset': self.offset, 'mdtm': self.mdtm, 'partial': self.partial}
+
+    @classmethod
+    def from_dict(cls, state):
+        tail = cls(str(state['filename']) if state['filename'] is not None else None)
+        tail.offset = state['offset']
+        tail.mdtm = state['mdtm']
+        tail.partial = str(state['partial'])
+        return tail
 
-        ftp = ftplib.FTP( ftpdata['ftp']['server'] )
+    def feed(self, data):
+        # returns the complete lines, keeps the trailing partial line for the next call
+        data = self.partial + data
+        end = data.rfind('\n') + 1
+        self.partial = data[end:]
+        return data[:end]
 
-        # login based on account given.
-        ftp.login(ftpdata['ftp']['user'] , ftpdata['ftp']['password'])
+def _tail_into(ftp_session, filename, state, write):
+    # pass the complete lines appended to filename since state.offset to write, chunk by
+    # chunk as they arrive. when the transfer fails the state is left as it was, the
+    # caller should then drop what was written.
+    saved = (state.offset, state.partial, state.mdtm)
+    def handle_binary(more_data):
+        state.offset += len(more_data)
+        lines = state.feed(more_data)
+        if lines:
+            write(lines)
 
-        ftp.cwd(ftpdata['ftp']['dir'])
+    try:
+        try:
+            ftp_session.retrieve(filename, handle_binary, state.offset)
+        except ftplib.error_perm:
+            if saved[0] == 0:
+                raise
+            # offset past the end, the file was replaced: start over
+            state.reset(filename)
+            ftp_session.retrieve(filename, handle_binary)
+    except:
+        (state.offset, state.partial, state.mdtm) = saved
+        raise
 
-        return ftpdata
+def tail(jsonconfig, filename, state, write=None):
+    # fetch only the bytes appended to filename since the previous call. the complete lines
+    # are returned, or passed to write(lines) chunk by chunk while they arrive when write is given
+    if state.filename != filename:
+        state.reset(filename)
+    sio = StringIO.StringIO()
+    _tail_into(session(jsonconfig), filename, state, write or sio.write)
+    sio.seek(0)
+    return sio
+
+def connect(ftpjson):
+    ftp_session = session(ftpjson)
+    pprint(ftp_session.ftpdata['ftp'])
+    ftp_session.get()
+    return ftp_session.ftpdata
         
 def upload(ftp, file):
     ext = os.path.splitext(file)[1]
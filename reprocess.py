@@ -0,0 +1,165 @@
+# processes archived days in parallel and writes them to one column store.
+#
+#   python reprocess.py archive --start 20170601 --end 20170630 --output campaign
+#
+# the drone files are in the archive under the file names of the drones in drones.json (see
+# acquisition.load_drones), archive/YYYYMMDD.txt without it, and the Cabauw files are
+# archive/cabauw/YYYYMMDD* (see --cabauw-dir). every day is processed into a day cache of
+# its own (see cache.py, --cache-dir, not the one of the live session) first, a day whose cache
+# has already read the archived files of every drone completely is not processed again. a day
+# is built next to its cache and renamed into place, caches that reprocess did not write are
+# never touched and days from today on are refused. the output has the same layout as the
+# cache, open it with DayCache('campaign').load('drone'), or the name of the drone.
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+import numpy as np
+from acquisition import load_drones
+from cache import DayCache
+from data import DroneProcessor, process_cabauw_data
+from pyftpbbc import FileTail
+
+
+def read_tail(path):
+    # the complete lines of path and the FileTail state of having read it all
+    tail = FileTail(os.path.basename(path))
+    with open(path, 'rb') as f:
+        data = f.read()
+    tail.offset = len(data)
+    return tail.feed(data), tail
+
+def archived_files(args, drones, day):
+    # (dict of drone name -> its file, None when it did not fly, the Cabauw files)
+    stamp = day.strftime('%Y%m%d')
+    radios = dict((name, os.path.join(args.archive, day.strftime(filename))) for (name, filename, metadata) in drones)
+    cabauw = sorted(os.path.join(args.cabauw_dir, f) for f in os.listdir(args.cabauw_dir) if f.startswith(stamp))
+    return dict((name, radio if os.path.exists(radio) else None) for (name, radio) in radios.items()), cabauw
+
+def is_cached(cache, radios, cabauw):
+    # whether the cache read the archived files of every drone up to their current size
+    state = cache.state
+    if state is None or not state.get('reprocessed') or 'drones' not in state:
+        return False
+    for (name, radio) in radios.items():
+        # a cache written for other drones, e.g. by a live session, is not used
+        drone_state = state['drones'].get(name)
+        if drone_state is None:
+            return False
+        if radio is not None and drone_state['tail']['offset'] != os.path.getsize(radio):
+            return False
+    manifest = state['cabauw_manifest']
+    return all(os.path.basename(f) in manifest and manifest[os.path.basename(f)]['offset'] == os.path.getsize(f) for f in cabauw)
+
+def process_day(task):
+    # runs in a pool process, returns (day, dict of drone name -> drone rows, cabauw rows,
+    # whether the cache was used)
+    (args, drones, metadata_cabauw, day) = task
+    (radios, cabauw) = archived_files(args, drones, day)
+    directory = os.path.join(args.cache_dir, day.strftime('%Y%m%d'))
+    cache = DayCache(directory)
+    if is_cached(cache, radios, cabauw):
+        return (day, dict((name, cache.rows(name)) for name in radios), cache.rows('cabauw'), True)
+    building = tempfile.mkdtemp(prefix=day.strftime('%Y%m%d') + '.', dir=args.cache_dir)
+    try:
+        return build_day(drones, metadata_cabauw, day, radios, cabauw, building, directory)
+    except:
+        shutil.rmtree(building, True)
+        raise
+
+def build_day(drones, metadata_cabauw, day, radios, cabauw, building, directory):
+    # processes the day into the directory building, which then replaces directory
+    cache = DayCache(building)
+
+    manifest = {}
+    chunks = []
+    for f in cabauw:
+        (data, tail) = read_tail(f)
+        manifest[tail.filename] = tail
+        chunks.append(data)
+    cabauw_data = process_cabauw_data(''.join(chunks), day, metadata_cabauw, None)
+
+    feeds = {'cabauw': cabauw_data}
+    drone_states = {}
+    for (name, filename, metadata_radio) in drones:
+        processor = DroneProcessor(metadata_radio)
+        radio_tail = FileTail()
+        feeds[name] = {}
+        if radios[name] is not None:
+            (data, radio_tail) = read_tail(radios[name])
+            # start the height integration from the Cabauw pressure when the drone data starts
+            pressure = cabauw_data['air_pressure']
+            if len(pressure) > 0:
+                first = data[:data.find('\n')].split()
+                start = np.datetime64(day, 's') + (int(first[0]) if first else 0)
+                current_air_pressure = pressure[max(0, np.searchsorted(cabauw_data['time'], start, side='right') - 1)]
+            else:
+                current_air_pressure = 1013.25
+            feeds[name] = processor.process(data, day, current_air_pressure, None)
+        previous = processor.previous
+        drone_states[name] = {
+            'tail': radio_tail.as_dict(),
+            'processor': [float(v) for v in previous] if previous is not None else None
+        }
+
+    cache.append(feeds, {
+        'reprocessed': True,
+        'drones': drone_states,
+        'cabauw_manifest': dict((f, tail.as_dict()) for (f, tail) in manifest.items())
+    })
+    # main made sure that an existing cache of the day was written by reprocess
+    if os.path.isdir(directory):
+        shutil.rmtree(directory)
+    os.rename(building, directory)
+    cache = DayCache(directory)
+    return (day, dict((name, cache.rows(name)) for name in radios), cache.rows('cabauw'), False)
+
+def main():
+    parser = argparse.ArgumentParser(description="Process a range of archived days into one column store")
+    parser.add_argument("archive", help="Directory with the drone files, YYYYMMDD.txt by default")
+    parser.add_argument("--cabauw-dir", help="Directory with the YYYYMMDD* Cabauw files, ARCHIVE/cabauw by default")
+    parser.add_argument("--start", help="First day, YYYYMMDD", required=True)
+    parser.add_argument("--end", help="Last day, YYYYMMDD", required=True)
+    parser.add_argument("--output", help="Directory for the consolidated columns", required=True)
+    parser.add_argument("--cache-dir", help="Directory for the per day cache, not the one of a live session", default="reprocess_cache")
+    parser.add_argument("--drones", help="The drones and their file names, see acquisition.load_drones", default="drones.json")
+    parser.add_argument("--processes", help="Number of worker processes, all cores by default", type=int)
+    args = parser.parse_args()
+    if args.cabauw_dir is None:
+        args.cabauw_dir = os.path.join(args.archive, 'cabauw')
+
+    if os.path.exists(os.path.join(args.output, 'index.json')):
+        parser.error('{0} already holds a column store'.format(args.output))
+
+    drones = [(drone.name, drone.filename, drone.metadata) for drone in load_drones(args.drones)]
+    metadata_cabauw = json.loads(open('metadata_cab.json').read())['metadata']['columns']
+    first = datetime.strptime(args.start, '%Y%m%d')
+    last = datetime.strptime(args.end, '%Y%m%d')
+    days = [first + timedelta(days=d) for d in range((last - first).days + 1)]
+    if last >= datetime.now().replace(hour=0, minute=0, second=0, microsecond=0):
+        parser.error('{0} has not ended yet, its files are still growing'.format(args.end))
+    for day in days:
+        directory = os.path.join(args.cache_dir, day.strftime('%Y%m%d'))
+        if os.path.exists(directory) and not (DayCache(directory).state or {}).get('reprocessed'):
+            parser.error('The cache of {0} in {1} was not written by reprocess.py, pick another --cache-dir'.format(day.strftime('%Y-%m-%d'), args.cache_dir))
+    if not os.path.isdir(args.cache_dir):
+        os.makedirs(args.cache_dir)
+
+    pool = multiprocessing.Pool(args.processes)
+    output = DayCache(args.output)
+    try:
+        # the days come back in order, they are consolidated while the others are processed
+        for (day, drone_rows, cabauw_rows, cached) in pool.imap(process_day, [(args, drones, metadata_cabauw, day) for day in days]):
+            print('{0} {1} {2:>6d} Cabauw rows{3}'.format(day.strftime('%Y-%m-%d'),
+                ' '.join('{0:>8d} {1} rows'.format(drone_rows[name], name) for (name, filename, metadata) in drones), cabauw_rows, ' (cached)' if cached else ''))
+            cache = DayCache(os.path.join(args.cache_dir, day.strftime('%Y%m%d')))
+            output.append(dict((feed, cache.load(feed)) for feed in cache.feeds()))
+    finally:
+        pool.close()
+        pool.join()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+# the flights of a drone, and the profiles within them, found while the samples come in.
+#
+#   flights = FlightSegmenter()
+#   flights.update(store)        # after every append to the drone column store
+#   store['temperature'][flights.slice(flights.flights[-1], store)]
+#
+# a flight starts at takeoff, when the GPS height is more than ground_m above the ground
+# and the pressure agrees (ground_m / 8 hPa lower, about 8 m per hPa near the ground), and
+# ends at landing, when both are back within half that range. the ground is the first sample,
+# or the first one after split(); its pressure is taken again from the last sample before
+# every takeoff and from every landing, as the surface pressure drifts during the morning
+# (the GPS height does not). within a flight a profile turns from ascent to descent
+# once the height dropped turn_m below its highest point, and back once it rose turn_m above
+# its lowest point; the turning point ends the one profile and starts the next.
+# flights and profiles are [start, stop) sample numbers, counted from the first sample the
+# segmenter saw, with stop None while they go on. an update only looks at the new samples,
+# and finding the flight or profile of a sample bisects their starts.
+import bisect
+import numpy as np
+
+ASCENT = 'ascent'
+DESCENT = 'descent'
+
+
+def find(condition, i, stop):
+    # the first index in [i, stop) where condition(start, stop) holds for the samples, None
+    # when there is none. the samples are scanned in windows that double, so finding it
+    # costs about as much as the samples up to it
+    size = 64
+    while i < stop:
+        j = min(stop, i + size)
+        hits = np.flatnonzero(condition(i, j))
+        if len(hits) > 0:
+            return i + hits[0]
+        i = j
+        size *= 2
+    return None
+
+class FlightSegmenter(object):
+    def __init__(self, ground_m=10.0, turn_m=20.0):
+        self.ground_m = ground_m
+        self.turn_m = turn_m
+        self.reset()
+
+    def reset(self):
+        # number of samples seen
+        self.count = 0
+        # (GPS height, pressure) on the ground
+        self.ground = None
+        # pressure of the last sample seen
+        self.last_pressure = None
+        # None on the ground, else ASCENT or DESCENT
+        self.phase = None
+        # (height, sample) of the highest point of the ascent or the lowest of the descent so far
+        self.extreme = None
+        # [start, stop] and [start, stop, direction], with their starts for bisect
+        self.flights = []
+        self.flight_starts = []
+        self.profiles = []
+        self.profile_starts = []
+
+    def update(self, store):
+        # segments the rows appended to the drone column store since the last update
+        new = store.appended - self.count
+        if new <= 0 or 'height' not in store:
+            return
+        if new > len(store):
+            # rows that were dropped (see max_rows) before they were seen
+            self.count += new - len(store)
+            new = len(store)
+        self.feed(store['height'][-new:], store['air_pressure'][-new:])
+
+    def feed(self, height, pressure):
+        height = np.asarray(height, dtype=float)
+        pressure = np.asarray(pressure, dtype=float)
+        n = len(height)
+        if n == 0:
+            return
+        base = self.count
+        if self.ground is None:
+            self.ground = (height[0], pressure[0])
+        def airborne(i, j):
+            (ground_height, ground_pressure) = self.ground
+            return (height[i:j] > ground_height + self.ground_m) & (pressure[i:j] < ground_pressure - self.ground_m / 8.0)
+        def landed(i, j):
+            (ground_height, ground_pressure) = self.ground
+            return (height[i:j] <= ground_height + self.ground_m / 2) & (pressure[i:j] >= ground_pressure - self.ground_m / 16.0)
+
+        i = 0
+        while i < n:
+            if self.phase is None:
+                k = find(airborne, i, n)
+                if k is None:
+                    break
+                # from the last sample on the ground
+                start = max(0, base + k - 1)
+                if self.flights and self.flights[-1][1] is None:
+                    # a flight that was started by hand, see split
+                    start = max(start, self.flights[-1][0])
+                else:
+                    self._open(self.flights, self.flight_starts, [start, None])
+                self._open(self.profiles, self.profile_starts, [start, None, ASCENT])
+                self.phase = ASCENT
+                self.extreme = (height[k], base + k)
+                # the landing is found from the pressure of the last sample on the ground
+                self.ground = (self.ground[0], pressure[k - 1] if k > 0 else self.last_pressure)
+                i = k + 1
+                continue
+
+            land = find(landed, i, n)
+            stop = n if land is None else land
+            j = self._turn(height, i, stop, base)
+            if j is not None:
+                turn = self.extreme[1]
+                self.profiles[-1][1] = turn + 1
+                self.phase = DESCENT if self.phase == ASCENT else ASCENT
+                self._open(self.profiles, self.profile_starts, [turn, None, self.phase])
+                # the samples between the turning point and j never went past j
+                # (or there would have been a turn before), so the new extreme is in here
+                self.extreme = None
+                self._extend(height, max(i, turn - base), j + 1, base)
+                i = j + 1
+                continue
+
+            if land is None:
+                break
+            # the landing sample is the last of the flight
+            self.profiles[-1][1] = base + land + 1
+            self.flights[-1][1] = base + land + 1
+            self.phase = None
+            self.extreme = None
+            # on the ground again, takeoffs are found from the pressure here
+            self.ground = (self.ground[0], pressure[land])
+            i = land + 1
+        self.count += n
+        self.last_pressure = pressure[-1]
+
+    def _open(self, segments, starts, segment):
+        segments.append(segment)
+        starts.append(segment[0])
+
+    def _turn(self, height, i, stop, base):
+        # index of the first sample in height[i:stop] where the profile turns, or None, with
+        # the extreme moved along the samples before it. the samples are scanned in windows
+        # that double, so finding a turn costs about as much as the samples up to it
+        size = 64
+        while i < stop:
+            block = height[i:min(stop, i + size)]
+            if self.phase == ASCENT:
+                turned = block < np.maximum(np.maximum.accumulate(block), self.extreme[0]) - self.turn_m
+            else:
+                turned = block > np.minimum(np.minimum.accumulate(block), self.extreme[0]) + self.turn_m
+            hits = np.flatnonzero(turned)
+            if len(hits) > 0:
+                self._extend(height, i, i + hits[0], base)
+                return i + hits[0]
+            self._extend(height, i, i + len(block), base)
+            i += len(block)
+            size *= 2
+        return None
+
+    def _extend(self, height, i, stop, base):
+        # move the extreme to the highest (lowest) sample of height[i:stop] past it
+        block = height[i:stop]
+        if len(block) == 0:
+            return
+        k = np.argmax(block) if self.phase == ASCENT else np.argmin(block)
+        if self.extreme is None or (block[k] > self.extreme[0] if self.phase == ASCENT else block[k] < self.extreme[0]):
+            self.extreme = (block[k], base + i + k)
+
+    def split(self):
+        # the operator starts a new flight from the next sample on, which is on the ground
+        if self.flights and self.flights[-1][1] is None:
+            self.flights[-1][1] = self.count
+        if self.profiles and self.profiles[-1][1] is None:
+            self.profiles[-1][1] = self.count
+        self._open(self.flights, self.flight_starts, [self.count, None])
+        self.phase = None
+        self.extreme = None
+        self.ground = None
+
+    def flight_at(self, sample):
+        # index in flights of the flight of sample, None when it was on the ground
+        return self._at(self.flights, self.flight_starts, sample)
+
+    def profile_at(self, sample):
+        return self._at(self.profiles, self.profile_starts, sample)
+
+    def _at(self, segments, starts, sample):
+        i = bisect.bisect_right(starts, sample) - 1
+        if i < 0 or (segments[i][1] is not None and sample >= segments[i][1]):
+            return None
+        return i
+
+    def slice(self, segment, store):
+        # the rows of a flight or profile in the column store, for views like store['q'][slice]
+        first_row = store.appended - len(store)
+        start = min(len(store), max(0, segment[0] - first_row))
+        stop = len(store) if segment[1] is None else min(len(store), max(0, segment[1] - first_row))
+        return slice(start, stop)
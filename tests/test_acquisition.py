@@ -0,0 +1,68 @@
+# run from the repository root: python -m unittest discover tests
+import ftplib
+import unittest
+import acquisition
+import pyftpbbc
+from benchmarks.synthetic import radio_text, cabauw_text
+
+
+class FakeServer(object):
+    # the drone files by config, tailed the way pyftpbbc.tail does
+    def __init__(self):
+        self.files = {'north.json': radio_text(4 * 3600, 600), 'broken.json': radio_text(4 * 3600, 600)}
+        self.broken = True
+        self.cabauw = cabauw_text(acquisition.metadata_cabauw, 4 * 3600, 600)
+
+    def tail(self, config, filename, state, write):
+        if config not in self.files:
+            raise ftplib.error_perm('550 no such file')
+        data = self.files[config]
+        if config == 'broken.json' and self.broken:
+            # half of the file arrives, then the connection drops
+            half = len(data) // 2
+            state.offset = half
+            write(state.feed(data[:half]))
+            raise IOError('connection reset')
+        lines = state.feed(data[state.offset:])
+        state.offset = len(data)
+        if lines:
+            write(lines)
+
+    def poll_all(self, config, pattern, manifest, write):
+        if 'cab' not in manifest:
+            manifest['cab'] = pyftpbbc.FileTail('cab')
+            write(self.cabauw)
+
+class GetSensorDataTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer()
+        self.saved = (acquisition.drones, pyftpbbc.tail, pyftpbbc.poll_all)
+        acquisition.drones = [acquisition.DroneFeed(name, config=name + '.json') for name in ('north', 'missing', 'broken')]
+        acquisition.cabauw_manifest.clear()
+        pyftpbbc.tail = self.server.tail
+        pyftpbbc.poll_all = self.server.poll_all
+
+    def tearDown(self):
+        (acquisition.drones, pyftpbbc.tail, pyftpbbc.poll_all) = self.saved
+        acquisition.cabauw_manifest.clear()
+
+    def test_failing_drones_do_not_block_the_others(self):
+        (drone_data, cabauw_data) = acquisition.getSensorData({}, None, None)
+        self.assertEqual(len(drone_data['north']['time']), 600)
+        self.assertEqual(len(drone_data['missing']['time']), 0)
+        self.assertEqual(len(drone_data['broken']['time']), 0)
+        self.assertEqual(len(cabauw_data['time']), 10)
+        # the broken drone starts over from where it was
+        state = acquisition.get_state()['drones']
+        self.assertEqual(state['broken']['tail']['offset'], 0)
+        self.assertEqual(state['missing']['tail']['offset'], 0)
+
+        self.server.broken = False
+        self.server.files['missing.json'] = radio_text(4 * 3600, 300)
+        (drone_data, cabauw_data) = acquisition.getSensorData({'north': drone_data['north']['time'][-1]}, cabauw_data['time'][-1], cabauw_data['air_pressure'][-1])
+        self.assertEqual(len(drone_data['north']['time']), 0)
+        self.assertEqual(len(drone_data['missing']['time']), 300)
+        self.assertEqual(len(drone_data['broken']['time']), 600)
+
+if __name__ == '__main__':
+    unittest.main()
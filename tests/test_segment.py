@@ -0,0 +1,47 @@
+# run from the repository root: python -m unittest discover tests
+import unittest
+import numpy as np
+from segment import FlightSegmenter, ASCENT, DESCENT
+
+
+def morning(flights=18, drift_hpa=-1.5, seed=0):
+    # (height, pressure, flights) at 1 Hz: every 20 minutes a 10 minute flight up to 200 m
+    # and back, while the surface pressure drifts by drift_hpa over the morning
+    rng = np.random.RandomState(seed)
+    cycle = np.concatenate([np.zeros(300), np.linspace(0, 200, 300), np.linspace(200, 0, 300), np.zeros(300)])
+    height = np.tile(cycle, flights) + 2.0 * rng.normal(0, 1, len(cycle) * flights).clip(-1, 1)
+    surface = 1013.0 + np.linspace(0, drift_hpa, len(height))
+    pressure = surface - height / 8.3 + rng.normal(0, 0.05, len(height))
+    expected = [(1200 * f + 300, 1200 * f + 900) for f in range(flights)]
+    return height, pressure, expected
+
+class FlightSegmenterTest(unittest.TestCase):
+    def check(self, segmenter, expected):
+        self.assertEqual(len(segmenter.flights), len(expected))
+        for ((start, stop), (takeoff, landing)) in zip(segmenter.flights, expected):
+            self.assertTrue(stop is not None)
+            self.assertTrue(abs(start - takeoff) < 30 and abs(stop - landing) < 30, (start, stop, takeoff, landing))
+        # an ascent and a descent per flight
+        self.assertEqual([p[2] for p in segmenter.profiles], [ASCENT, DESCENT] * len(expected))
+
+    def test_flights_while_the_pressure_drifts(self):
+        for drift_hpa in (-1.5, 1.5):
+            (height, pressure, expected) = morning(drift_hpa=drift_hpa)
+            segmenter = FlightSegmenter()
+            segmenter.feed(height, pressure)
+            self.check(segmenter, expected)
+
+    def test_chunks(self):
+        (height, pressure, expected) = morning()
+        whole = FlightSegmenter()
+        whole.feed(height, pressure)
+        segmenter = FlightSegmenter()
+        stops = np.sort(np.random.RandomState(1).randint(0, len(height), 200))
+        for (i, j) in zip(np.r_[0, stops], np.r_[stops, len(height)]):
+            segmenter.feed(height[i:j], pressure[i:j])
+        self.assertEqual(segmenter.flights, whole.flights)
+        self.assertEqual(segmenter.profiles, whole.profiles)
+        self.check(segmenter, expected)
+
+if __name__ == '__main__':
+    unittest.main()